@@ -0,0 +1,87 @@
+# Copyright 2022 Cartesi Pte. Ltd.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy of the
+# License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+"""
+Admission of the inputs of seated senders
+
+Out of turn inputs and spam are turned down from the sender's seat, the game's phase and
+the input's opcode alone, before the game decodes the body and before it is touched. Only
+inputs the game would reject anyway are turned down, so admission never changes the outcome
+of an input.
+
+Senders not seated yet can only join, their public key is parsed up front so that a key no
+player could encrypt a role with never takes a seat.
+"""
+
+from werewolf.cipher import get_cipher
+from werewolf.inputs import Input, Op
+from werewolf.model import HANDLERS, Phase
+
+MALFORMED = "malformed"
+ALREADY_JOINED = "already_joined"
+NOT_MODERATOR = "not_moderator"
+OUT_OF_TURN = "out_of_turn"
+DEAD = "dead"
+ALREADY_VOTED = "already_voted"
+ALREADY_MOVED = "already_moved"
+BAD_KEY = "bad_key"
+
+
+def admit_join(game, input: Input):
+    """
+    Return why the join of a sender not seated yet is turned down, None to let it through
+    """
+    if game.opcode_of(input) is not Op.JOIN:
+        return None
+    try:
+        get_cipher().load_public(input.payload)
+    except Exception:
+        return BAD_KEY
+    return None
+
+
+def admit(game, input: Input):
+    """
+    Return why the input of a sender seated at the game is turned down, None to let it through
+    """
+    phase = game.phase
+    if phase is Phase.OVER:
+        # keys revealed after the result are only checked once all of them are in
+        return None
+    if phase is Phase.JOINING:
+        return ALREADY_JOINED
+    if phase is Phase.DISPATCHING:
+        return None if input.sender == game._moderator else NOT_MODERATOR
+
+    opcode = game.opcode_of(input)
+    if (phase, opcode) not in HANDLERS:
+        return OUT_OF_TURN
+    if opcode is Op.REVEAL:
+        # revealing keys is left to the game
+        return None
+    if opcode is Op.FINISH:
+        # settling the game, and whether it is over, is left to the game
+        return None if input.sender == game._moderator else NOT_MODERATOR
+
+    if opcode is Op.KILL:
+        if input.sender != game._moderator:
+            return NOT_MODERATOR
+        return OUT_OF_TURN if game._moves != len(game._alives) else None
+
+    player = game._players[input.sender]
+    if input.sender == game._moderator:
+        return OUT_OF_TURN
+    if not player.alive:
+        return DEAD
+    if opcode is Op.VOTE:
+        return ALREADY_VOTED if player.has_voted else None
+    return ALREADY_MOVED if player.has_moved else None
@@ -0,0 +1,211 @@
+# Copyright 2022 Cartesi Pte. Ltd.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy of the
+# License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+"""
+Performance benchmarks with stored baselines
+
+Runs every benchmark offline, compares the results with benchmarks.json and fails when one
+got worse than its baseline by more than the tolerance:
+
+    python3 -m werewolf.bench
+    python3 -m werewolf.bench --only inspect_encode --update
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from werewolf.cipher import get_cipher
+from werewolf.inputs import Input
+from werewolf.model import Game
+from werewolf.query import resolve
+from werewolf.registry import Registry
+from werewolf.replay import group_by_game, replay_game
+from werewolf.roles import assign_roles, decrypt_roles, encrypt_roles
+from werewolf import simulator
+
+BASELINES = os.path.join(os.path.dirname(__file__), "..", "benchmarks.json")
+DEFAULT_TOLERANCE = 0.5
+
+BENCHMARKS = {}
+
+
+def benchmark(name: str, higher=()):
+    """
+    Register a benchmark returning a dict of metrics, the metrics in higher are better when
+    they grow and every other one is better when it shrinks
+    """
+    def register(f):
+        BENCHMARKS[name] = (f, frozenset(higher))
+        return f
+    return register
+
+
+def _best(f, repeat: int):
+    """
+    Shortest of several runs of f, the least disturbed by the rest of the machine
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def _input(sender: str, payload: str):
+    return Input.decode(sender, bytes.fromhex(payload))
+
+
+def _built_game(players: int, nights: int):
+    """
+    Game in the middle of a night after the given number of nights, every alive player moved
+    """
+    game = Game(0, players)
+    ids = [f"0X{i:040X}" for i in range(players)]
+    for id in ids:
+        game.handle_advance(_input(id, "ab" * 140))
+    moderator = game._moderator
+    alive = [p for p in ids if p != moderator]
+    game.handle_advance(_input(moderator, json.dumps({p: "cd" * 128 for p in alive}).encode().hex()))
+
+    for night in range(nights + 1):
+        for p in alive:
+            game.handle_advance(_input(p, "ef" * 128))
+        if night == nights:
+            break
+        game.handle_advance(_input(moderator, alive.pop().encode().hex()))
+        voted = alive[-1]
+        for p in alive:
+            game.handle_advance(_input(p, voted.encode().hex()))
+        alive.pop()
+    return game
+
+
+@benchmark("game_throughput", higher=("inputs_per_second",))
+def game_throughput():
+    records = simulator.play_in_process(simulator.make_scripts(50, seed=1), Registry())
+    games = group_by_game(records)
+    seconds = _best(lambda: [replay_game(g) for g in games], 3)
+    return {"inputs_per_second": len(records) / seconds}
+
+
+@benchmark("inspect_encode")
+def inspect_encode():
+    result = {}
+    for players, nights in ((6, 0), (6, 1), (60, 0), (60, 10), (600, 0), (600, 100)):
+        game = _built_game(players, nights)
+        reps = max(1, 3000 // players)
+        seconds = _best(lambda: [game.handle_inspect() for _ in range(reps)], 3) / reps
+        key = f"{players}_players_{nights}_nights"
+        result[f"{key}_us"] = seconds * 1e6
+        result[f"{key}_bytes"] = len(game.handle_inspect())
+    result["600_players_phase_bytes"] = len(resolve(_built_game(600, 0), ["phase"]))
+    return result
+
+
+@benchmark("dapp_round_trip", higher=("inputs_per_second",))
+def dapp_round_trip():
+    summary = simulator.run(20, inspects=2, seed=1)
+    return {
+        "inputs_per_second": summary["inputs_per_second"],
+        "advance_p50_ms": summary["advance_state"]["p50_ms"],
+        "advance_p99_ms": summary["advance_state"]["p99_ms"],
+        "inspect_p50_ms": summary["inspect_state"]["p50_ms"],
+        "inspect_p99_ms": summary["inspect_state"]["p99_ms"],
+    }
+
+
+@benchmark("client_crypto")
+def client_crypto():
+    cipher = get_cipher()
+    result = {"new_keys_1024_ms": _best(lambda: cipher.new_keys(1024), 3) * 1e3}
+
+    pairs = [cipher.new_keys(1024) for _ in range(6)]
+    for players in (6, 60):
+        ids = [f"0X{i:040X}" for i in range(players)]
+        keys = {p: pairs[i % len(pairs)] for i, p in enumerate(ids)}
+        pub_keys = {p: cipher.dump_public(k[0]).hex() for p, k in keys.items()}
+        roles = assign_roles(ids, ids[0])
+        encrypted = encrypt_roles(pub_keys, roles, processes=1)
+        revealed = [(p, pub_keys[p], cipher.dump_private(keys[p][1]).hex(), encrypted[p])
+                    for p in roles]
+        result[f"encrypt_roles_{players}_ms"] = _best(
+            lambda: encrypt_roles(pub_keys, roles, processes=1), 3) * 1e3
+        result[f"decrypt_roles_{players}_ms"] = _best(
+            lambda: decrypt_roles(revealed, processes=1), 3) * 1e3
+    return result
+
+
+def compare(name: str, metrics, higher, stored):
+    """
+    Return one report line per metric and whether any of them regressed
+
+    Tolerances are looked up by metric, then by benchmark, then fall back to the default one.
+    """
+    baselines = stored["benchmarks"].get(name, {})
+    tolerances = stored.get("tolerances", {})
+    lines = []
+    regressed = False
+    for metric, value in metrics.items():
+        baseline = baselines.get(metric)
+        if baseline is None:
+            lines.append(f"{name}.{metric}: {value:.6g} (no baseline)")
+            continue
+        tolerance = tolerances.get(f"{name}.{metric}",
+                                   tolerances.get(name, stored.get("tolerance", DEFAULT_TOLERANCE)))
+        change = (value - baseline) / baseline if baseline else 0.0
+        worse = -change if metric in higher else change
+        status = "ok"
+        if worse > tolerance:
+            status = "REGRESSION"
+            regressed = True
+        elif worse < -tolerance:
+            status = "improved"
+        lines.append(f"{name}.{metric}: {value:.6g} vs {baseline:.6g} ({change:+.1%}) {status}")
+    return lines, regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), default=None)
+    parser.add_argument("--baselines", default=BASELINES)
+    parser.add_argument("--update", action="store_true", help="store the results as baselines")
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    stored = {"tolerance": DEFAULT_TOLERANCE, "benchmarks": {}}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            stored = json.load(f)
+
+    regressed = False
+    for name in args.only or sorted(BENCHMARKS):
+        f, higher = BENCHMARKS[name]
+        metrics = f()
+        lines, worse = compare(name, metrics, higher, stored)
+        print("\n".join(lines), flush=True)
+        regressed = regressed or worse
+        if args.update:
+            stored["benchmarks"][name] = metrics
+
+    if args.update:
+        with open(args.baselines, "w") as f:
+            json.dump(stored, f, indent=2, sort_keys=True)
+            f.write("\n")
+    sys.exit(1 if regressed and not args.update else 0)
+
+
+if __name__ == "__main__":
+    main()
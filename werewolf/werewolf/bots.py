@@ -0,0 +1,297 @@
+# Copyright 2022 Cartesi Pte. Ltd.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy of the
+# License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+"""
+Headless bot players and parallel self-play
+
+Bots play the same protocol as the client, reading the game through inspect queries and
+sending the same inputs in the versioned wire format, against in-process games spread
+across a process pool:
+
+    python3 -m werewolf.bots --games 1000 --werewolf always-kill --villagers bandwagon
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from werewolf.cipher import get_cipher
+from werewolf.codec import decode_report
+from werewolf.inputs import Input, Op, encode
+from werewolf.model import Game, NUMBER_OF_PLAYER
+from werewolf.query import resolve
+from werewolf.roles import assign_roles, dispatch_payload, encrypt_roles
+
+
+# ballots in a single day before a game that keeps tying is given up
+MAX_BALLOTS = 64
+
+
+class Strategy:
+    """
+    How a bot picks its victim when it is the werewolf and its candidate during the day
+
+    Candidates map the players that can be picked to the votes they got so far, seats gives
+    every player's seat number at the table.
+    """
+
+    def kill(self, me: str, candidates, seats, rnd: random.Random):
+        return rnd.choice(sorted(candidates))
+
+    def vote(self, me: str, candidates, seats, rnd: random.Random):
+        return rnd.choice(sorted(candidates))
+
+
+class RandomVoter(Strategy):
+    pass
+
+
+class AlwaysKill(Strategy):
+    """
+    Kills the player sitting on the given seat while alive, the lowest seat alive otherwise
+    """
+
+    def __init__(self, seat: int = 0):
+        self._seat = seat
+
+    def kill(self, me, candidates, seats, rnd):
+        return min(candidates, key=lambda p: (seats[p] != self._seat, seats[p]))
+
+
+class ScriptedWerewolf(Strategy):
+    """
+    Kills in the order of its script of seats, the highest seat first without one, skipping
+    the seats no longer alive, and joins whoever leads the vote during the day
+    """
+
+    def __init__(self, script=None):
+        self._script = list(script) if script else None
+
+    def kill(self, me, candidates, seats, rnd):
+        script = self._script or sorted(seats.values(), reverse=True)
+        for seat in script:
+            victim = next((p for p in candidates if seats[p] == seat), None)
+            if victim is not None:
+                return victim
+        return super().kill(me, candidates, seats, rnd)
+
+    def vote(self, me, candidates, seats, rnd):
+        return max(sorted(candidates), key=lambda p: candidates[p])
+
+
+class Bandwagon(Strategy):
+    """
+    Votes for whoever leads the vote, randomly while nobody does
+    """
+
+    def vote(self, me, candidates, seats, rnd):
+        top = max(candidates.values())
+        return rnd.choice(sorted(p for p, votes in candidates.items() if votes == top))
+
+
+STRATEGIES = {
+    "random": RandomVoter,
+    "always-kill": AlwaysKill,
+    "scripted": ScriptedWerewolf,
+    "bandwagon": Bandwagon,
+}
+
+
+class Bot:
+    """
+    One seat at a table, holding its keys and role as a client does
+    """
+
+    def __init__(self, address: str, seat: int, keys, strategy: Strategy):
+        self.address = address
+        self.seat = seat
+        self.public_key, self.private_key = keys
+        self.strategy = strategy
+        self.role = None
+
+
+class Table:
+    """
+    An in-process game and its bots, read through inspect queries like a remote back-end
+    """
+
+    def __init__(self, game: Game, bots, cipher):
+        self.game = game
+        self.bots = {b.address: b for b in bots}
+        self.seats = {b.address: b.seat for b in bots}
+        self.cipher = cipher
+        self.inputs = 0
+        self.rejected = Counter()
+
+    def query(self, *query):
+        return decode_report(resolve(self.game, list(query))).value
+
+    def send(self, bot: Bot, opcode: Op, body: bytes = b""):
+        self.inputs += 1
+        try:
+            self.game.handle_advance(Input.decode(bot.address, encode(opcode, body)))
+        except Exception as e:
+            self.rejected[str(e)] += 1
+        self.game.pop_notices()
+
+    def reveal(self, bot: Bot):
+        self.send(bot, Op.REVEAL, self.cipher.dump_private(bot.private_key))
+
+
+def play_game(seed: int, table_size: int = NUMBER_OF_PLAYER, werewolf: str = "random",
+              villagers: str = "random", keys=None, cipher_name: str = None):
+    """
+    Play one complete game and return its outcome
+    """
+    rnd = random.Random(seed)
+    cipher = get_cipher(cipher_name)
+    keys = keys or [cipher.new_keys(512) for _ in range(table_size)]
+    bots = [Bot(f"0X{i + 1:040X}", i, keys[rnd.randrange(len(keys))], None)
+            for i in range(table_size)]
+    table = Table(Game(seed, table_size), bots, cipher)
+
+    for bot in bots:
+        table.send(bot, Op.JOIN, cipher.dump_public(bot.public_key))
+
+    phase = table.query("phase")
+    moderator = table.bots[phase.moderator]
+    roles = assign_roles([b.address for b in bots], moderator.address, rnd)
+    pub_keys = {p: table.query("player", p).pub_key for p in roles}
+    table.send(moderator, Op.DISPATCH, bytes.fromhex(dispatch_payload(
+        encrypt_roles(pub_keys, roles, processes=1, cipher_name=cipher_name))))
+    for address in roles:
+        bot = table.bots[address]
+        encrypted = table.query("player", address).encrypted_role
+        bot.role = cipher.decrypt(bytes.fromhex(encrypted), bot.private_key).decode()
+        bot.strategy = STRATEGIES[werewolf if bot.role == "WEREWOLF" else villagers]()
+    wolf = next(p for p, role in roles.items() if role == "WEREWOLF")
+    moderator_key = cipher.load_public(
+        bytes.fromhex(table.query("player", moderator.address).pub_key))
+
+    rounds_limit = 2 * table_size
+    while not table.query("phase").game_result and rounds_limit:
+        rounds_limit -= 1
+        phase = table.query("phase")
+        alives = table.query("alives")
+
+        if not phase.is_daytime:
+            for address in sorted(alives):
+                bot = table.bots[address]
+                move = "dummy"
+                if bot.role == "WEREWOLF":
+                    candidates = {p: 0 for p in alives if p != address}
+                    move = bot.strategy.kill(address, candidates, table.seats, rnd)
+                table.send(bot, Op.MOVE, cipher.encrypt(move.encode(), moderator_key))
+
+            victim = ""
+            for sender, move in table.query("moves", str(phase.rounds)):
+                if sender == wolf:
+                    victim = cipher.decrypt(bytes.fromhex(move), moderator.private_key).decode()
+            table.send(moderator, Op.KILL, victim.encode())
+            table.reveal(table.bots[victim])
+        else:
+            ballots = MAX_BALLOTS
+            while table.query("phase").is_daytime and ballots:
+                # deterministic strategies may tie forever, leave the game unfinished then
+                ballots -= 1
+                for address in sorted(alives):
+                    candidates = {p: 0 for p in alives if p != address}
+                    for p in candidates:
+                        candidates[p] = table.query("player", p).votes_got
+                    candidates = {p: votes for p, votes in candidates.items()
+                                  if table.query("player", p).can_be_voted}
+                    bot = table.bots[address]
+                    table.send(bot, Op.VOTE, bot.strategy.vote(address, candidates, table.seats,
+                                                                rnd).encode())
+            for voted_out in sorted(alives - table.query("alives")):
+                table.reveal(table.bots[voted_out])
+            if not ballots:
+                break
+
+        # the moderator settles the game as soon as it is over, as the client does
+        alives = table.query("alives")
+        if wolf not in alives or len(alives) == 2:
+            table.send(moderator, Op.FINISH)
+
+    phase = table.query("phase")
+    for address in sorted(table.query("alives")):
+        table.reveal(table.bots[address])
+
+    return {"seed": seed, "result": phase.game_result or "unfinished", "rounds": phase.rounds,
+            "inputs": table.inputs, "rejected": dict(table.rejected)}
+
+
+def _play_chunk(seeds, table_size: int, werewolf: str, villagers: str, distinct_keys: int):
+    logging.disable(logging.CRITICAL)
+    cipher = get_cipher()
+    keys = [cipher.new_keys(512) for _ in range(distinct_keys)]
+    return [play_game(seed, table_size, werewolf, villagers, keys) for seed in seeds]
+
+
+def self_play(games: int, table_size: int = NUMBER_OF_PLAYER, werewolf: str = "random",
+              villagers: str = "random", processes: int = None, seed: int = 0,
+              distinct_keys: int = 8):
+    """
+    Play many games across a process pool, return a summary and every game's outcome
+    """
+    processes = processes or os.cpu_count() or 1
+    seeds = list(range(seed, seed + games))
+    chunks = [seeds[i::processes] for i in range(min(processes, games))]
+    start = time.perf_counter()
+    results = []
+    if processes == 1:
+        for chunk in chunks:
+            results.extend(_play_chunk(chunk, table_size, werewolf, villagers, distinct_keys))
+    else:
+        n = len(chunks)
+        with ProcessPoolExecutor(processes) as pool:
+            for chunk in pool.map(_play_chunk, chunks, [table_size] * n, [werewolf] * n,
+                                  [villagers] * n, [distinct_keys] * n):
+                results.extend(chunk)
+    elapsed = time.perf_counter() - start
+
+    rejected = Counter()
+    for r in results:
+        rejected.update(r["rejected"])
+    summary = {
+        "games": len(results),
+        "seconds": elapsed,
+        "games_per_second": len(results) / elapsed if elapsed else 0.0,
+        "inputs": sum(r["inputs"] for r in results),
+        "outcomes": dict(Counter(r["result"] for r in results)),
+        "rounds": dict(sorted(Counter(r["rounds"] for r in results).items())),
+        "rejected": dict(rejected),
+    }
+    return summary, sorted(results, key=lambda r: r["seed"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--players", type=int, default=NUMBER_OF_PLAYER)
+    parser.add_argument("--werewolf", choices=sorted(STRATEGIES), default="random")
+    parser.add_argument("--villagers", choices=sorted(STRATEGIES), default="random")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    summary, _ = self_play(args.games, args.players, args.werewolf, args.villagers,
+                           args.processes, args.seed)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
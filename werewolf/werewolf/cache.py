@@ -0,0 +1,75 @@
+# Copyright 2022 Cartesi Pte. Ltd.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy of the
+# License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+from collections import OrderedDict
+
+
+class ReportCache:
+    """
+    Encoded inspect reports
+
+    Entries are keyed by game, state version and query, so a game can hold several encodings
+    of the same state at once. The entries of a game are dropped when its state changes, the
+    least recently used ones are evicted once the cache grows over max_bytes.
+    """
+
+    def __init__(self, max_bytes: int):
+        self._max_bytes = max_bytes
+        self._size = 0
+        self._entries = OrderedDict()
+        self._by_game = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self):
+        return self._size
+
+    def __drop(self, key):
+        self._size -= len(self._entries.pop(key))
+        keys = self._by_game[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._by_game[key[0]]
+
+    def get(self, game_id: int, version: int, query: tuple):
+        key = (game_id, version, query)
+        report = self._entries.get(key)
+        if report is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return report
+
+    def put(self, game_id: int, version: int, query: tuple, report: str):
+        if len(report) > self._max_bytes:
+            return
+
+        key = (game_id, version, query)
+        if key in self._entries:
+            self.__drop(key)
+
+        self._entries[key] = report
+        self._by_game.setdefault(game_id, set()).add(key)
+        self._size += len(report)
+
+        while self._size > self._max_bytes:
+            self.__drop(next(iter(self._entries)))
+
+    def invalidate(self, game_id: int):
+        for key in self._by_game.pop(game_id, ()):
+            self._size -= len(self._entries.pop(key))
@@ -0,0 +1,203 @@
+# Copyright 2022 Cartesi Pte. Ltd.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy of the
+# License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+"""
+Registry checkpoints for fast restarts
+
+A checkpoint holds a deterministic snapshot of every game along with the index of the last
+input it covers and the sha256 hash of the snapshot. Next to it, an outputs journal keeps the
+status and notices of every input. On restart the back-end restores the checkpoint, answers
+the inputs it covers from the journal, and replays the inputs that came after, checking the
+tail it had processed before against the journal. To check a checkpoint file:
+
+    python3 -m werewolf.checkpoint werewolf.ckpt
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+from werewolf.metrics import METRICS
+from werewolf.registry import Registry
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"WWCP"
+FORMAT = 1
+# magic, format, last input index, sha256 of the snapshot
+HEADER = struct.Struct(">4sHq32s")
+
+
+def canonical(state):
+    return json.dumps(state, sort_keys=True, separators=(",", ":")).encode()
+
+
+def state_hash(registry: Registry):
+    return hashlib.sha256(canonical(registry.snapshot())).hexdigest()
+
+
+def save(path: str, registry: Registry, input_index: int):
+    """
+    Atomically write a checkpoint of the registry after the given input
+    """
+    body = canonical(registry.snapshot())
+    digest = hashlib.sha256(body).digest()
+    with open(path + ".tmp", "wb") as f:
+        f.write(HEADER.pack(MAGIC, FORMAT, input_index, digest))
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+    return digest.hex()
+
+
+def load(path: str):
+    """
+    Restore the registry of a checkpoint, return it with the last input index it covers
+
+    Raises ValueError when the file is not a checkpoint, is corrupted, or does not restore
+    to the state it was taken from.
+    """
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        if len(m) < HEADER.size:
+            raise ValueError(f"{path} is too short to be a checkpoint")
+        magic, version, input_index, digest = HEADER.unpack_from(m)
+        if magic != MAGIC or version != FORMAT:
+            raise ValueError(f"{path} is not a version {FORMAT} checkpoint")
+        # hash and decode straight from the mapping, the body is never copied as bytes
+        with memoryview(m) as view, view[HEADER.size:] as body:
+            if hashlib.sha256(body).digest() != digest:
+                raise ValueError(f"{path} is corrupted")
+            state = json.loads(str(body, "utf-8"))
+
+    registry = Registry.restore(state)
+    if state_hash(registry) != digest.hex():
+        raise ValueError(f"{path} does not restore to the state it was taken from")
+    return registry, input_index
+
+
+class Outputs:
+    """
+    Append-only journal of the status and notices of every input, one JSON line per input
+
+    Inputs are looked up in order, so the journal is streamed rather than loaded.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self.last_input_index = -1
+        if os.path.exists(path):
+            for record in self.__records():
+                self.last_input_index = record[0]
+        self._reader = self.__records()
+        self._next = None
+        self._file = open(path, "a")
+
+    def __records(self):
+        if not os.path.exists(self._path):
+            return
+        with open(self._path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def get(self, input_index: int):
+        """
+        Recorded (status, notices) of an input, None when it was never recorded
+        """
+        while self._next is None or self._next[0] < input_index:
+            self._next = next(self._reader, None)
+            if self._next is None:
+                return None
+        if self._next[0] != input_index:
+            return None
+        return self._next[1], self._next[2]
+
+    def append(self, input_index: int, status: str, notices):
+        if input_index <= self.last_input_index:
+            return
+        self._file.write(json.dumps([input_index, status, notices], separators=(",", ":")) + "\n")
+        self._file.flush()
+        self.last_input_index = input_index
+
+
+class Checkpointer:
+    """
+    Writes a checkpoint every so many inputs and skips the inputs it covers after a restart,
+    answering them with the outputs they had
+    """
+
+    def __init__(self, path: str, every: int = 100):
+        self._path = path
+        self._every = every
+        self._last = -1
+        self._pending = 0
+        self._outputs = Outputs(path + ".outputs")
+
+    @property
+    def last_input_index(self):
+        return self._last
+
+    def restore(self):
+        """
+        Return the registry of the current checkpoint, or None when there is none yet
+        """
+        if not os.path.exists(self._path):
+            return None
+
+        registry, self._last = load(self._path)
+        logger.info("Restored checkpoint of input %d from %s", self._last, self._path)
+        return registry
+
+    def covers(self, input_index: int):
+        return input_index <= self._last
+
+    def recorded(self, input_index: int):
+        """
+        Status and notices an input had when it was first processed, None if unknown
+        """
+        return self._outputs.get(input_index)
+
+    def processed(self, registry: Registry, input_index: int, status: str, notices):
+        # inputs processed after the checkpoint but before a restart must come out the same
+        recorded = self._outputs.get(input_index)
+        if recorded is not None and recorded != (status, notices):
+            METRICS.count("checkpoint.mismatches")
+            logger.error("Input %d replayed to %s with %d notices, it was %s with %d before",
+                         input_index, status, len(notices), recorded[0], len(recorded[1]))
+        self._outputs.append(input_index, status, notices)
+        self._pending += 1
+        if self._pending >= self._every:
+            self.save(registry, input_index)
+
+    def save(self, registry: Registry, input_index: int):
+        digest = save(self._path, registry, input_index)
+        self._last = input_index
+        self._pending = 0
+        logger.info("Checkpoint of input %d written, state hash %s", input_index, digest)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("path")
+    args = parser.parse_args()
+
+    registry, input_index = load(args.path)
+    print(json.dumps({"input_index": input_index, "state_hash": state_hash(registry),
+                      "games": len(registry.games), "lobby": registry.lobby}))
+
+
+if __name__ == "__main__":
+    main()
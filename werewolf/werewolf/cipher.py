@@ -0,0 +1,110 @@
+# Copyright 2022 Cartesi Pte. Ltd.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy of the
+# License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+import os
+import rsa
+from abc import ABC, abstractmethod
+
+
+class Cipher(ABC):
+    """
+    Public key cipher used to hide roles and moves
+
+    Keys travel as PKCS#1 DER and messages are PKCS#1 v1.5 encrypted, every backend has to
+    stay compatible with that so that players using different backends can share a table.
+    """
+
+    @abstractmethod
+    def new_keys(self, bits: int):
+        pass
+
+    @abstractmethod
+    def load_public(self, der: bytes):
+        pass
+
+    @abstractmethod
+    def load_private(self, der: bytes):
+        pass
+
+    @abstractmethod
+    def dump_public(self, key):
+        pass
+
+    @abstractmethod
+    def dump_private(self, key):
+        pass
+
+    @abstractmethod
+    def public_of(self, private_key):
+        pass
+
+    @abstractmethod
+    def encrypt(self, message: bytes, public_key):
+        pass
+
+    @abstractmethod
+    def decrypt(self, ciphertext: bytes, private_key):
+        pass
+
+
+class RsaCipher(Cipher):
+    """
+    Pure Python backend based on the rsa package
+    """
+
+    def new_keys(self, bits: int):
+        return rsa.newkeys(bits)
+
+    def load_public(self, der: bytes):
+        return rsa.PublicKey.load_pkcs1(der, "DER")
+
+    def load_private(self, der: bytes):
+        return rsa.PrivateKey.load_pkcs1(der, "DER")
+
+    def dump_public(self, key):
+        return key.save_pkcs1("DER")
+
+    def dump_private(self, key):
+        return key.save_pkcs1("DER")
+
+    def public_of(self, private_key):
+        return rsa.PublicKey(private_key.n, private_key.e)
+
+    def encrypt(self, message: bytes, public_key):
+        return rsa.encrypt(message, public_key)
+
+    def decrypt(self, ciphertext: bytes, private_key):
+        return rsa.decrypt(ciphertext, private_key)
+
+
+BACKENDS = {
+    "rsa": RsaCipher,
+}
+
+_ciphers = {}
+
+
+def register(name: str, backend):
+    BACKENDS[name] = backend
+
+
+def get_cipher(name: str = None):
+    """
+    Return the named backend, WEREWOLF_CIPHER selects it by default
+    """
+    name = name or os.environ.get("WEREWOLF_CIPHER", "rsa")
+    cipher = _ciphers.get(name)
+    if cipher is None:
+        if name not in BACKENDS:
+            raise ValueError(f"unknown cipher backend {name}")
+        cipher = _ciphers[name] = BACKENDS[name]()
+    return cipher
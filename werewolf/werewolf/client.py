@@ -1,11 +1,8 @@
+from werewolf.cipher import get_cipher
+from werewolf.keys import KeyPool
 from werewolf.network import Network
-import time
-import rsa
-import random
+from werewolf.roles import assign_roles, dispatch_payload, encrypt_roles
 import sys
-import json
-
-NUMBER_OF_PLAYER = 6
 
 player_ids = ["0xf39Fd6e51aad88F6F4ce6aB8827279cffFb92266".upper(),
               "0x70997970C51812dc3A010C7d01b50e0d17dc79C8".upper(),
@@ -15,105 +12,91 @@ player_ids = ["0xf39Fd6e51aad88F6F4ce6aB8827279cffFb92266".upper(),
               "0x9965507D1a55bcC2695C58ba16FB37d819B0A4dc".upper()]
 
 
+def may_be_over(g):
+    # the game goes on while nobody dead is or may be the werewolf
+    if len(g.alives) <= 2:
+        return True
+    return any(p.role != "VILLAGER" for id, p in g.players.items()
+               if id != g.moderator and id not in g.alives)
+
+
 def main(player_index):
     signer_address = player_ids[player_index]
     print(f"\n Your address is : *** {signer_address} ***\n")
     n = Network()
 
-    public_key, private_key = rsa.newkeys(2048)
+    cipher = get_cipher()
+    key_pool = KeyPool(cipher=cipher)
+    public_key, private_key = key_pool.take()
+    key_pool.start_refill()
     # send public key to join the game
-    n.send_on_chain(public_key.save_pkcs1("DER").hex(), player_index)
-
-    moderator = ""
+    n.send_on_chain(cipher.dump_public(public_key).hex(), player_index)
 
     # get game state and moderator
-    while not moderator:
-        g = n.inspect()
-        moderator = g._moderator
-        time.sleep(1)
+    g = n.wait_for(signer_address, lambda g: g.moderator)
+    moderator = g.moderator
 
     if signer_address == moderator:
         role = "MODERATOR"
 
         # randomly choose a werewolf and send out all roles
-        other_players = list(g._players.keys())
-        other_players.remove(moderator)
-        werewolf = random.choice(other_players)
-
-        encrypted_roles = {}
-        for i in range(0, NUMBER_OF_PLAYER):
-            player = player_ids[i]
-            if player == moderator:
-                continue
-            elif player == werewolf:
-                encrypted_roles[player] = rsa.encrypt("WEREWOLF".encode(
-                ), rsa.PublicKey.load_pkcs1(bytes.fromhex(g._players[player].pub_key), "DER")).hex()
-            else:
-                encrypted_roles[player] = rsa.encrypt("VILLAGER".encode(
-                ), rsa.PublicKey.load_pkcs1(bytes.fromhex(g._players[player].pub_key), "DER")).hex()
-
-        dump_encrypted_roles = json.dumps(encrypted_roles)
-        n.send_on_chain(dump_encrypted_roles.encode().hex(), player_index)
+        roles = assign_roles(g.players, moderator)
+        werewolf = next(p for p, r in roles.items() if r == "WEREWOLF")
+
+        encrypted_roles = encrypt_roles(
+            {p: g.players[p].pub_key for p in roles}, roles)
+        n.send_on_chain(dispatch_payload(encrypted_roles), player_index)
     else:
-        encrypted_role = ""
         # wait for role
-        while len(encrypted_role) == 0:
-            g = n.inspect()
-            encrypted_role = g._players[signer_address].encrypted_role
-            time.sleep(1)
+        p = n.wait_for(f"{signer_address}/player/{signer_address}",
+                       lambda p: p.value.encrypted_role)
+        encrypted_role = p.value.encrypted_role
 
-        role = rsa.decrypt(bytes.fromhex(encrypted_role), private_key).decode()
+        role = cipher.decrypt(bytes.fromhex(encrypted_role), private_key).decode()
 
     print("\nYour role is *** ", role, " ***\n")
 
     # game begins
 
-    g = n.inspect()
-    moderator_public_key = rsa.PublicKey.load_pkcs1(
-        bytes.fromhex(g._players[moderator].pub_key), "DER")
-    moves_counter = 0
+    g = n.inspect(signer_address)
+    moderator_public_key = cipher.load_public(
+        bytes.fromhex(g.players[moderator].pub_key))
     while True:
-        if len(g._game_result) != 0:
-            print(g._game_result + "\n")
-            n.send_on_chain(private_key.save_pkcs1("DER").hex(), player_index)
+        if len(g.game_result) != 0:
+            print(g.game_result + "\n")
+            n.send_on_chain(cipher.dump_private(private_key).hex(), player_index)
             break
         # get the current round and _is_daytime
-        # round = g._rounds
-        _is_daytime = g._is_daytime
+        # round = g.rounds
+        _is_daytime = g.is_daytime
 
         if _is_daytime == False:
             print("\nnight falls...\n")
             if role == 'WEREWOLF':
-                if not g._players[signer_address].has_moved:
+                if not g.players[signer_address].has_moved:
                     victim = input('Who would you kill?\n')
-                    n.send_on_chain(rsa.encrypt(
+                    n.send_on_chain(cipher.encrypt(
                         victim.encode(), moderator_public_key).hex(), player_index)
             elif role == 'VILLAGER':
-                if not g._players[signer_address].has_moved:
-                    n.send_on_chain(rsa.encrypt(
+                if not g.players[signer_address].has_moved:
+                    n.send_on_chain(cipher.encrypt(
                         "dummy".encode(), moderator_public_key).hex(), player_index)
             elif role == 'MODERATOR':
-                while len(g._move_history) < moves_counter + len(g._alives):
-                    time.sleep(1)
-                    g = n.inspect()
-
-                if len(g._move_history) == moves_counter + len(g._alives):
-                    move_history = g._move_history[moves_counter: moves_counter + len(
-                        g._alives)]
+                phase = n.wait_for(f"{signer_address}/phase",
+                                   lambda p: p.value.moves >= p.value.alives).value
 
+                if phase.moves == phase.alives:
                     victim = ""
-                    for m in move_history:
-                        payload = rsa.decrypt(
-                            bytes.fromhex(m["payload"]), private_key).decode()
+                    moves = n.inspect(f"{signer_address}/moves/{phase.rounds}").value
+                    for sender, move in moves:
+                        payload = cipher.decrypt(
+                            bytes.fromhex(move), private_key).decode()
 
-                        sender = m["metadata"]["msg_sender"].upper()
                         if sender == werewolf:
                             victim = payload
 
                     print(f"victim: {victim}\n")
                     n.send_on_chain(victim.encode().hex(), player_index)
-
-                    moves_counter += len(g._alives)
         else:
             print("\nday breaks...\n")
             # discuss who is werewolf and vote
@@ -123,16 +106,18 @@ def main(player_index):
                 # revote if tie?
 
         # wait till day/night toggles
-        while (_is_daytime == g._is_daytime):
-            time.sleep(1)
-            g = n.inspect()
+        n.wait_for(f"{signer_address}/phase", lambda p: _is_daytime !=
+                   p.value.is_daytime or p.value.game_result)
+        g = n.inspect(signer_address)
 
         # check if game has finished
         if role == 'MODERATOR':
-            alives = len(g._alives)
-            werewolf_alive = (werewolf in g._alives)
+            alives = len(g.alives)
+            werewolf_alive = (werewolf in g.alives)
             finish_payload = "finish"
             if alives > 2 and not werewolf_alive:
+                # the game is settled once the werewolf's revealed key proves it died
+                n.wait_for(f"{signer_address}/phase", lambda p: p.value.werewolf)
                 n.send_on_chain(finish_payload.encode().hex(), player_index)
                 print("\nVillagers win !!!\n")
                 break
@@ -140,23 +125,21 @@ def main(player_index):
                 n.send_on_chain(finish_payload.encode().hex(), player_index)
                 print("\nWerewolf wins !!!\n")
                 break
-        elif not signer_address in g._alives:
+        elif not signer_address in g.alives:
             print("I died...\n")
             # reveal private key
-            n.send_on_chain(private_key.save_pkcs1("DER").hex(), player_index)
+            n.send_on_chain(cipher.dump_private(private_key).hex(), player_index)
             break
         else:
-            # wait for moderator to check if the game finishes
-            time.sleep(15)
-            g = n.inspect()
-            if g._game_result != "":
+            # wait for moderator to check if the game finishes, as long as it may have
+            g = n.wait_for(signer_address, lambda g: g.game_result or not may_be_over(
+                g), timeout=15)
+            if g.game_result != "":
                 break
 
-        
-        g = n.inspect()
-
     print("game ended.\n")
     # n.send_on_chain(private_key, player_index)
 
 
-main(int(sys.argv[1]))
+if __name__ == "__main__":
+    main(int(sys.argv[1]))
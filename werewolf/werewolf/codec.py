@@ -0,0 +1,287 @@
+# Copyright 2022 Cartesi Pte. Ltd.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy of the
+# License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+import base64
+import json
+
+# Reports are flat JSON arrays laid out by the schemas below, the first element is the
+# format version and the second one tells a full snapshot from a delta. Binary fields
+# travel as base64 and come back as hex once decoded.
+# Any change to a schema must bump VERSION.
+VERSION = 5
+
+SNAPSHOT = 0
+DELTA = 1
+NOTICE = 2
+# projections answering inspect queries, laid out as [VERSION, kind, game, version, value]
+PHASE = 3
+PLAYER = 4
+ALIVES = 5
+MOVES_OF = 6
+
+ROLES = ("MODERATOR", "WEREWOLF", "VILLAGER", "UNKNOWN")
+
+GAME_SCHEMA = ("id", "version", "number_of_players", "started", "is_daytime", "rounds",
+               "moves", "votes", "moderator", "werewolf", "game_result", "alives", "players",
+               "move_log")
+# a delta only carries the players touched since the base version and the moves appended
+# since then, along with the rounds whose moves are still live
+DELTA_SCHEMA = GAME_SCHEMA + ("live_rounds",)
+PLAYER_SCHEMA = ("id", "pub_key", "role", "alive", "can_be_voted", "has_voted",
+                 "has_moved", "votes_got", "encrypted_role")
+MOVE_SCHEMA = ("round", "sender", "payload")
+# alives only counts the players still alive
+PHASE_SCHEMA = ("started", "is_daytime", "rounds", "moves", "votes", "moderator", "werewolf",
+                "game_result", "alives")
+PROJECTION_SCHEMA = ("id", "version", "value")
+
+# Notices carry the events of one input, coalesced as [VERSION, NOTICE, game, version, events]
+# where version is the state version the input led to. Every event starts with its kind.
+NOTICE_SCHEMA = ("id", "version", "events")
+# player, moderator once the table is full
+JOINED = "joined"
+# number of players who got a role
+DISPATCHED = "dispatched"
+# round, victim of the werewolf
+KILLED = "killed"
+# round, player voted out or "" on a tie, candidates of the revote
+VOTED = "voted"
+# round, (sender, payload) moves of the night, archived out of the live state
+MOVES = "moves"
+# player, role, revealed by a dead player
+REVEALED = "revealed"
+# result, (player, role) of every revealed player
+FINISHED = "finished"
+
+
+def _pack(hex: str):
+    return base64.b64encode(bytes.fromhex(hex)).decode()
+
+
+def _pack_bytes(data: bytes):
+    return base64.b64encode(data).decode()
+
+
+def _unpack(b64: str):
+    return base64.b64decode(b64).hex()
+
+
+def _dumps(obj):
+    return json.dumps(obj, separators=(",", ":"))
+
+
+class PlayerState:
+    """
+    Decoded player state, as seen by clients
+    """
+
+    __slots__ = PLAYER_SCHEMA
+
+    def __init__(self, record):
+        (self.id, pub_key, role, alive, can_be_voted, has_voted,
+         has_moved, self.votes_got, encrypted_role) = record
+        self.pub_key = _unpack(pub_key)
+        self.role = ROLES[role]
+        self.alive = bool(alive)
+        self.can_be_voted = bool(can_be_voted)
+        self.has_voted = bool(has_voted)
+        self.has_moved = bool(has_moved)
+        self.encrypted_role = _unpack(encrypted_role)
+
+
+class GameState:
+    """
+    Decoded game state, as seen by clients
+    """
+
+    __slots__ = GAME_SCHEMA
+
+    def __init__(self, record):
+        self.players = {}
+        self.move_log = {}
+        self.apply(record)
+
+    def moves_of(self, round: int):
+        """
+        Live (sender, payload) moves of a night
+        """
+        return self.move_log.get(round, [])
+
+    def apply(self, record, live_rounds=None):
+        """
+        Update the state in place with a snapshot or delta record
+        """
+        (self.id, self.version, self.number_of_players, started, is_daytime, self.rounds,
+         self.moves, self.votes, self.moderator, self.werewolf, self.game_result, alives,
+         players, move_log) = record
+        self.started = bool(started)
+        self.is_daytime = bool(is_daytime)
+        self.alives = set(alives)
+        self.players.update((p[0], PlayerState(p)) for p in players)
+        if live_rounds is not None:
+            for round in [r for r in self.move_log if r not in live_rounds]:
+                del self.move_log[round]
+        for round, sender, payload in move_log:
+            self.move_log.setdefault(round, []).append((sender, _unpack(payload)))
+
+
+class PhaseState:
+    """
+    Decoded phase of a game, as seen by clients
+    """
+
+    __slots__ = PHASE_SCHEMA
+
+    def __init__(self, record):
+        (started, is_daytime, self.rounds, self.moves, self.votes, self.moderator,
+         self.werewolf, self.game_result, self.alives) = record
+        self.started = bool(started)
+        self.is_daytime = bool(is_daytime)
+
+
+class Projection:
+    """
+    Decoded answer to an inspect query, along with the game and state version it comes from
+    """
+
+    __slots__ = PROJECTION_SCHEMA
+
+    def __init__(self, id: int, version: int, value):
+        self.id = id
+        self.version = version
+        self.value = value
+
+
+def encode_player(player):
+    return [player.id, _pack(player.pub_key), ROLES.index(player.role.name),
+            int(player.alive), int(player.can_be_voted), int(player.has_voted),
+            int(player.has_moved), player.votes_got, _pack(player.encrypted_role)]
+
+
+def encode_move(round: int, sender: str, payload: bytes):
+    return [round, sender, _pack_bytes(payload)]
+
+
+def _encode(kind, game, players, moves):
+    return [
+        VERSION, kind, game._id, game._version, game._number_of_players,
+        int(game._started), int(game._is_daytime), game._rounds, game._moves,
+        game._votes, game._moderator, game._werewolf, game._game_result,
+        sorted(game._alives),
+        [encode_player(p) for p in players],
+        [encode_move(*m) for m in moves],
+    ]
+
+
+def encode_game(game):
+    return _dumps(_encode(SNAPSHOT, game, game._players.values(), game._move_log.since(0)))
+
+
+def encode_delta(game, touched, moves: int):
+    players = [game._players[id] for id in sorted(touched)]
+    record = _encode(DELTA, game, players, game._move_log.since(moves))
+    record.append(game._move_log.rounds)
+    return _dumps(record)
+
+
+def _projection(kind, game, value):
+    return _dumps([VERSION, kind, game._id, game._version, value])
+
+
+def encode_phase(game):
+    return _projection(PHASE, game, [
+        int(game._started), int(game._is_daytime), game._rounds, game._moves, game._votes,
+        game._moderator, game._werewolf, game._game_result, len(game._alives)])
+
+
+def encode_player_of(game, id: str):
+    player = game._players.get(id)
+    if player is None:
+        raise ValueError(f"player {id} is not found")
+    return _projection(PLAYER, game, encode_player(player))
+
+
+def encode_alives(game):
+    return _projection(ALIVES, game, sorted(game._alives))
+
+
+def encode_moves_of(game, round: int):
+    return _projection(MOVES_OF, game, [
+        [sender, _pack_bytes(payload)] for sender, payload in game._move_log.moves(round)])
+
+
+def moves_event(round: int, moves):
+    return [MOVES, round, [[sender, _pack_bytes(payload)] for sender, payload in moves]]
+
+
+def encode_notice(game, events):
+    return _dumps([VERSION, NOTICE, game._id, game._version, events])
+
+
+def decode_notice(notice: str):
+    """
+    Decode a notice into its game id, state version and events, move payloads come back as hex
+    """
+    record = json.loads(notice)
+    if record[0] != VERSION or record[1] != NOTICE:
+        raise ValueError("not a notice of this version")
+
+    game_id, version, events = record[2:]
+    for event in events:
+        if event[0] == MOVES:
+            event[2] = [(sender, _unpack(payload)) for sender, payload in event[2]]
+    return game_id, version, events
+
+
+def decode_game(report: str, base: GameState = None):
+    """
+    Decode a report into a new GameState, deltas are applied in place to the given base state
+    """
+    record = json.loads(report)
+    if record[0] != VERSION:
+        raise ValueError(f"unsupported state version {record[0]}")
+
+    if record[1] == SNAPSHOT:
+        return GameState(record[2:])
+
+    if base is None or base.id != record[2]:
+        raise ValueError("delta does not apply to the given state")
+
+    base.apply(record[2:-1], record[-1])
+    return base
+
+
+def decode_report(report: str, base: GameState = None):
+    """
+    Decode any report, game states come back as GameState and the answers to queries as
+    Projection. Live moves come back as (sender, payload) tuples with the payload in hex.
+    """
+    record = json.loads(report)
+    if record[0] != VERSION:
+        raise ValueError(f"unsupported state version {record[0]}")
+
+    kind = record[1]
+    if kind in (SNAPSHOT, DELTA):
+        return decode_game(report, base)
+
+    game_id, version, value = record[2:]
+    if kind == PHASE:
+        value = PhaseState(value)
+    elif kind == PLAYER:
+        value = PlayerState(value)
+    elif kind == ALIVES:
+        value = set(value)
+    elif kind == MOVES_OF:
+        value = [(sender, _unpack(payload)) for sender, payload in value]
+    else:
+        raise ValueError(f"unknown report kind {kind}")
+    return Projection(game_id, version, value)
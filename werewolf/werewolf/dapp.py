@@ -1,36 +1,102 @@
 
 from os import environ
+import json
 import logging
-import jsonpickle
-import requests
-from werewolf.model import Game
+import time
+from werewolf.cache import ReportCache
+from werewolf.admission import MALFORMED
+from werewolf.checkpoint import Checkpointer
+from werewolf.inputlog import InputLogWriter, Record
+from werewolf.inputs import Input
+from werewolf.logs import RecentInputs, Sampler, setup
+from werewolf.metrics import METRICS, profile_hook
+from werewolf.model import NUMBER_OF_PLAYER
+from werewolf.registry import Registry
+from werewolf.rollup import RollupServer
 
-logging.basicConfig(level="INFO")
+setup(environ.get("WEREWOLF_LOG_LEVEL", "INFO"))
 logger = logging.getLogger(__name__)
+# high frequency lines only make it to the log once every so many times
+sample = Sampler(int(environ.get("WEREWOLF_LOG_SAMPLE", 100)))
+recent = RecentInputs(int(environ.get("WEREWOLF_RECENT_INPUTS", 32)))
 
-rollup_server = environ["ROLLUP_HTTP_SERVER_URL"]
-logger.info(f"HTTP rollup_server url is {rollup_server}")
+rollup = RollupServer(environ["ROLLUP_HTTP_SERVER_URL"],
+                      min_backoff=float(environ.get("ROLLUP_MIN_BACKOFF", 0.05)),
+                      max_backoff=float(environ.get("ROLLUP_MAX_BACKOFF", 2.0)))
+logger.info("HTTP rollup_server url is %s", rollup.url)
 
 
 def handle_advance(data):
-    logger.info(f"Received advance request data {data}")
-    logger.info("Adding notice")
-    data["payload"] = data["payload"][2:]
-    g.handle_advance(data)
-    notice = {"payload": "0x7878"}
-    response = requests.post(rollup_server + "/notice", json=notice)
-    logger.info(
-        f"Received notice status {response.status_code} body {response.content}")
+    input_index = data["metadata"].get("input_index")
+    if sample("advance"):
+        logger.info("Received advance input %s from %s, %d so far", input_index,
+                    data["metadata"]["msg_sender"], sample.seen("advance"))
+    if checkpoints is not None and input_index is not None and checkpoints.covers(input_index):
+        if sample("skip"):
+            logger.info("Input %s is covered by the checkpoint, skipping it", input_index)
+        recorded = checkpoints.recorded(input_index)
+        if recorded is None:
+            logger.warning("Input %s has no recorded outputs, accepting it", input_index)
+            return "accept"
+        status, notices = recorded
+        if status == "accept":
+            for notice in notices:
+                rollup.notice("0x" + notice.encode().hex())
+        return status
+
+    try:
+        input = Input.from_advance(data)
+    except ValueError as e:
+        logger.warning("Malformed input %s: %s", input_index, e)
+        METRICS.count(f"rejected.{MALFORMED}")
+        if checkpoints is not None and input_index is not None:
+            checkpoints.processed(registry, input_index, "reject", [])
+        return "reject"
+
+    game_id, game = registry.route_advance(input.sender)
+    version = game.version
+    status = registry.handle_advance(input)
+    if game.version != version:
+        reports.invalidate(game_id)
+    notices = game.pop_notices()
+    if status != "accept":
+        notices = []
+    if checkpoints is not None and input_index is not None:
+        checkpoints.processed(registry, input_index, status, notices)
+    if inputs is not None:
+        inputs.write(Record(input_index, game_id, data["metadata"]["msg_sender"],
+                            input.wire(), status, notices))
+    if status != "accept":
+        return status
+    for notice in notices:
+        rollup.notice("0x" + notice.encode().hex())
     return "accept"
 
 
 def handle_inspect(data):
-    logger.info(f"Received inspect request data {data}")
-    logger.info("Adding report")
-    state = g.handle_inspect().encode().hex()
-    report = {"payload": "0x" + state}
-    response = requests.post(rollup_server + "/report", json=report)
-    logger.info(f"Received report status {response.status_code}")
+    payload = bytes.fromhex(data["payload"][2:]).decode(errors="replace")
+    if sample("inspect"):
+        logger.info("Received inspect %s, %d so far", payload, sample.seen("inspect"))
+    if payload.strip("/") == "metrics":
+        rollup.report("0x" + json.dumps(METRICS.snapshot()).encode().hex())
+        return "accept"
+
+    try:
+        game_id, game, query = registry.route_inspect(payload)
+        query = tuple(query)
+        state = reports.get(game_id, game.version, query)
+        if state is None:
+            state = "0x" + registry.handle_inspect(payload).encode().hex()
+            reports.put(game_id, game.version, query, state)
+    except Exception as e:
+        # a query the game cannot answer must not take the back-end down
+        if isinstance(e, ValueError):
+            logger.warning("Invalid inspect query %s: %s", payload, e)
+        else:
+            logger.exception("Failed to answer inspect query %s", payload)
+        rollup.report("0x" + str(e).encode().hex())
+        return "reject"
+    rollup.report(state)
     return "accept"
 
 
@@ -40,17 +106,41 @@ handlers = {
 }
 
 finish = {"status": "accept"}
-g = Game()
+checkpoints = None
+registry = None
+if environ.get("WEREWOLF_CHECKPOINT"):
+    checkpoints = Checkpointer(environ["WEREWOLF_CHECKPOINT"],
+                               int(environ.get("WEREWOLF_CHECKPOINT_EVERY", 100)))
+    registry = checkpoints.restore()
+if registry is None:
+    registry = Registry(int(environ.get("WEREWOLF_TABLE_SIZE", NUMBER_OF_PLAYER)))
+inputs = None
+if environ.get("WEREWOLF_INPUT_LOG"):
+    inputs = InputLogWriter(environ["WEREWOLF_INPUT_LOG"], registry.table_size)
+reports = ReportCache(int(environ.get("INSPECT_CACHE_BYTES", 8 * 1024 * 1024)))
+
+METRICS.gauge("games", lambda: len(registry.games))
+METRICS.gauge("players", lambda: registry.seated)
+METRICS.gauge("live_moves", lambda: sum(len(g._move_log) for g in registry.games.values()))
+METRICS.gauge("report_cache", lambda: {"entries": len(reports), "bytes": reports.size,
+                                       "hits": reports.hits, "misses": reports.misses})
+METRICS.gauge("rollup", rollup.stats)
+profiler = profile_hook(METRICS)
 
 while True:
-    logger.info("Sending finish")
-    response = requests.post(rollup_server + "/finish", json=finish)
-    logger.info(f"Received finish status {response.status_code}")
-    if response.status_code == 202:
-        logger.info("No pending rollup request, trying again")
-    else:
-        rollup_request = response.json()
-        data = rollup_request["data"]
-
-        handler = handlers[rollup_request["request_type"]]
-        finish["status"] = handler(rollup_request["data"])
+    if sample("finish"):
+        logger.debug("Sending finish with status %s", finish["status"])
+    rollup_request = rollup.finish(finish["status"])
+    request_type = rollup_request["request_type"]
+    handler = handlers[request_type]
+    recent.add(rollup_request)
+    start = time.perf_counter()
+    try:
+        with profiler:
+            finish["status"] = handler(rollup_request["data"])
+    except Exception:
+        logger.exception("Failed to handle %s request", request_type)
+        recent.dump(logger)
+        raise
+    METRICS.observe(request_type, time.perf_counter() - start)
+    METRICS.count(f"{request_type}.{finish['status']}")
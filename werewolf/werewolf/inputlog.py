@@ -0,0 +1,181 @@
+# Copyright 2022 Cartesi Pte. Ltd.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy of the
+# License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+"""
+Recorded advance inputs
+
+Every advance input is logged with the game it went to, the status it got and the notices its
+game emitted, either as JSON lines or, for files ending in .bin, in a compact binary form.
+A header record gives the table size in effect, it is repeated whenever the back-end restarts.
+Inputs replayed on a restart are logged once: the writer skips the input indexes the log
+already has, and readers skip any index at or below one they already yielded.
+"""
+
+import json
+import os
+import struct
+from werewolf.inputs import Input
+
+FORMAT = 1
+MAGIC = b"WWIL"
+STATUSES = ("accept", "reject")
+
+_HEADER = struct.Struct(">BH")
+# input index, game id, status, sender length
+_RECORD = struct.Struct(">qIBB")
+_LENGTH = struct.Struct(">I")
+_COUNT = struct.Struct(">H")
+_HEADER_TAG = 0
+_RECORD_TAG = 1
+
+
+class Record:
+    """
+    One advance input, payload is raw bytes and notices are the game's notices as text
+    """
+
+    __slots__ = ("input_index", "game", "sender", "payload", "status", "notices", "table_size")
+
+    def __init__(self, input_index: int, game: int, sender: str, payload: bytes, status: str,
+                 notices, table_size: int = None):
+        self.input_index = input_index
+        self.game = game
+        self.sender = sender
+        self.payload = payload
+        self.status = status
+        self.notices = list(notices)
+        self.table_size = table_size
+
+    def input(self):
+        """
+        The input as the games receive it, raises ValueError on malformed payloads
+        """
+        return Input.decode(self.sender, self.payload)
+
+
+def is_binary(path: str):
+    return path.endswith(".bin")
+
+
+class InputLogWriter:
+
+    def __init__(self, path: str, table_size: int):
+        self._binary = is_binary(path)
+        self._last = -1
+        if os.path.exists(path) and os.path.getsize(path):
+            for record in read_records(path):
+                if record.input_index is not None:
+                    self._last = record.input_index
+        self._file = open(path, "ab" if self._binary else "a")
+        if self._binary:
+            if self._file.tell() == 0:
+                self._file.write(MAGIC + bytes([FORMAT]))
+            self._file.write(_HEADER.pack(_HEADER_TAG, table_size))
+        else:
+            self._file.write(json.dumps({"format": FORMAT, "table_size": table_size}) + "\n")
+        self._file.flush()
+
+    def write(self, record: Record):
+        if record.input_index is not None:
+            if record.input_index <= self._last:
+                return
+            self._last = record.input_index
+        if self._binary:
+            sender = record.sender.encode()
+            parts = [bytes([_RECORD_TAG]),
+                     _RECORD.pack(record.input_index, record.game,
+                                  STATUSES.index(record.status), len(sender)),
+                     sender, _LENGTH.pack(len(record.payload)), record.payload,
+                     _COUNT.pack(len(record.notices))]
+            for notice in record.notices:
+                notice = notice.encode()
+                parts += [_LENGTH.pack(len(notice)), notice]
+            self._file.write(b"".join(parts))
+        else:
+            self._file.write(json.dumps({
+                "input_index": record.input_index, "game": record.game, "sender": record.sender,
+                "payload": record.payload.hex(), "status": record.status,
+                "notices": record.notices}, separators=(",", ":")) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def _read_json(path: str):
+    table_size = None
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            r = json.loads(line)
+            if "format" in r:
+                if r["format"] != FORMAT:
+                    raise ValueError(f"unsupported input log format {r['format']}")
+                table_size = r["table_size"]
+                continue
+            yield Record(r["input_index"], r["game"], r["sender"], bytes.fromhex(r["payload"]),
+                         r["status"], r["notices"], table_size)
+
+
+def _read_binary(path: str):
+    table_size = None
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:4] != MAGIC or data[4] != FORMAT:
+        raise ValueError(f"{path} is not a version {FORMAT} input log")
+
+    view = memoryview(data)
+    offset = 5
+    while offset < len(data):
+        if data[offset] == _HEADER_TAG:
+            _, table_size = _HEADER.unpack_from(view, offset)
+            offset += _HEADER.size
+            continue
+
+        offset += 1
+        input_index, game, status, length = _RECORD.unpack_from(view, offset)
+        offset += _RECORD.size
+        sender = bytes(view[offset:offset + length]).decode()
+        offset += length
+        (length,) = _LENGTH.unpack_from(view, offset)
+        offset += _LENGTH.size
+        payload = bytes(view[offset:offset + length])
+        offset += length
+        (count,) = _COUNT.unpack_from(view, offset)
+        offset += _COUNT.size
+        notices = []
+        for _ in range(count):
+            (length,) = _LENGTH.unpack_from(view, offset)
+            offset += _LENGTH.size
+            notices.append(bytes(view[offset:offset + length]).decode())
+            offset += length
+        yield Record(input_index, game, sender, payload, STATUSES[status], notices, table_size)
+
+
+def _deduplicated(records):
+    last = -1
+    for record in records:
+        if record.input_index is not None:
+            if record.input_index <= last:
+                continue
+            last = record.input_index
+        yield record
+
+
+def read_records(path: str):
+    """
+    Yield the records of an input log in the order they were written, each input index once
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    return _deduplicated(_read_binary(path) if is_binary(path) else _read_json(path))
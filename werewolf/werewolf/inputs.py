@@ -0,0 +1,97 @@
+# Copyright 2022 Cartesi Pte. Ltd.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy of the
+# License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+"""
+Advance inputs, decoded once
+
+Inputs come in two wire formats. Legacy payloads carry the bare body, such as a public key,
+an encrypted move or a candidate's address, and their opcode follows from the game's phase
+and the sender's seat. Versioned payloads start with MAGIC, the format version and an
+explicit opcode ahead of the body:
+
+    MAGIC (4 bytes) | VERSION (1 byte) | opcode (1 byte) | body
+"""
+
+from dataclasses import dataclass
+from enum import IntEnum
+
+MAGIC = b"WWIN"
+VERSION = 1
+HEADER_SIZE = len(MAGIC) + 2
+# legacy payload of the finish command, optionally followed by the keys to reveal
+FINISH_PREFIX = b"finish"
+
+
+class Op(IntEnum):
+    JOIN = 1
+    DISPATCH = 2
+    MOVE = 3
+    KILL = 4
+    VOTE = 5
+    REVEAL = 6
+    FINISH = 7
+
+
+@dataclass(slots=True, frozen=True)
+class Input:
+    """
+    Advance input with its sender normalized and its payload decoded from hex
+
+    The opcode of a legacy input is None until the game resolves it from its phase.
+    """
+
+    sender: str
+    payload: bytes
+    opcode: Op = None
+
+    @classmethod
+    def decode(cls, sender: str, wire: bytes):
+        """
+        Parse the payload bytes as sent, raises ValueError on malformed versioned payloads
+        """
+        if wire[:len(MAGIC)] != MAGIC:
+            return cls(sender.upper(), wire)
+
+        if len(wire) < HEADER_SIZE:
+            raise ValueError("truncated input header")
+        if wire[len(MAGIC)] != VERSION:
+            raise ValueError(f"unsupported input version {wire[len(MAGIC)]}")
+        try:
+            opcode = Op(wire[len(MAGIC) + 1])
+        except ValueError:
+            raise ValueError(f"unknown opcode {wire[len(MAGIC) + 1]}") from None
+        return cls(sender.upper(), wire[HEADER_SIZE:], opcode)
+
+    @classmethod
+    def from_advance(cls, data):
+        """
+        Parse an advance request's data, raises ValueError on malformed payloads
+        """
+        payload = data["payload"]
+        if payload[:2] in ("0x", "0X"):
+            payload = payload[2:]
+        return cls.decode(data["metadata"]["msg_sender"], bytes.fromhex(payload))
+
+    def wire(self):
+        """
+        Payload bytes as they were sent
+        """
+        if self.opcode is None:
+            return self.payload
+        return encode(self.opcode, self.payload)
+
+
+def encode(opcode: Op, body: bytes):
+    """
+    Versioned payload of an input, to be sent hex encoded
+    """
+    return MAGIC + bytes((VERSION, opcode)) + body
@@ -0,0 +1,124 @@
+# Copyright 2022 Cartesi Pte. Ltd.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy of the
+# License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+"""
+Pre-generated player key pool
+
+Keys are kept as files in a local cache directory, taking one claims it by renaming it so
+that concurrent clients never share a key. Private keys are in there, so the directory and
+its files are only readable by their owner. To fill the pool ahead of time:
+
+    python3 -m werewolf.keys --size 8
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import uuid
+from werewolf.cipher import get_cipher
+
+DEFAULT_BITS = 2048
+DEFAULT_SIZE = 4
+
+
+def default_directory():
+    return os.environ.get("WEREWOLF_KEY_CACHE") or os.path.join(
+        os.path.expanduser("~"), ".cache", "werewolf", "keys")
+
+
+class KeyPool:
+    """
+    On-disk pool of key pairs, topped up by a background process
+    """
+
+    def __init__(self, directory: str = None, size: int = DEFAULT_SIZE, bits: int = DEFAULT_BITS,
+                 cipher=None):
+        self._cipher = cipher or get_cipher()
+        self._size = size
+        self._bits = bits
+        self._directory = os.path.join(directory or default_directory(), str(bits))
+        os.makedirs(self._directory, mode=0o700, exist_ok=True)
+        os.chmod(self._directory, 0o700)
+
+    def __len__(self):
+        return len(self.__available())
+
+    def __available(self):
+        return [f for f in os.listdir(self._directory) if f.endswith(".key")]
+
+    def __store(self, public_key, private_key):
+        name = os.path.join(self._directory, uuid.uuid4().hex)
+        fd = os.open(name + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            public = self._cipher.dump_public(public_key)
+            f.write(len(public).to_bytes(4, "big") + public +
+                    self._cipher.dump_private(private_key))
+        os.replace(name + ".tmp", name + ".key")
+
+    def __load(self, path: str):
+        with open(path, "rb") as f:
+            data = f.read()
+        length = int.from_bytes(data[:4], "big")
+        return (self._cipher.load_public(data[4:4 + length]),
+                self._cipher.load_private(data[4 + length:]))
+
+    def take(self):
+        """
+        Return a (public_key, private_key) pair from the pool, or a freshly generated one
+        when the pool is empty
+        """
+        for name in self.__available():
+            path = os.path.join(self._directory, name)
+            claimed = path + ".taken"
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                # another client claimed it first
+                continue
+            try:
+                return self.__load(claimed)
+            finally:
+                os.remove(claimed)
+
+        return self._cipher.new_keys(self._bits)
+
+    def fill(self):
+        while len(self) < self._size:
+            self.__store(*self._cipher.new_keys(self._bits))
+
+    def start_refill(self):
+        """
+        Top the pool up in a detached process that outlives the caller
+        """
+        if len(self) >= self._size:
+            return None
+
+        return subprocess.Popen(
+            [sys.executable, "-m", "werewolf.keys", "--directory", os.path.dirname(self._directory),
+             "--size", str(self._size), "--bits", str(self._bits)],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--directory", default=None)
+    parser.add_argument("--size", type=int, default=DEFAULT_SIZE)
+    parser.add_argument("--bits", type=int, default=DEFAULT_BITS)
+    args = parser.parse_args()
+
+    KeyPool(args.directory, args.size, args.bits).fill()
+
+
+if __name__ == "__main__":
+    main()
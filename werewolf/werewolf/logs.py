@@ -0,0 +1,101 @@
+# Copyright 2022 Cartesi Pte. Ltd.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy of the
+# License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+"""
+Logging off the back-end's hot path
+
+Records are handed over to a background thread through a queue and only formatted there, so
+handlers pay for neither formatting nor writing. High frequency lines are sampled, and the
+full content of recent inputs is kept in memory and only logged when a handler raises.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+from collections import deque
+
+FORMAT = "%(asctime)s %(levelname)s %(name)s %(message)s"
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+
+    def prepare(self, record):
+        # leave the formatting to the listener thread, log arguments are never mutated
+        return record
+
+
+def setup(level: str = "INFO"):
+    """
+    Route every log record through a queue to a stderr writer running in the background
+    """
+    records = queue.SimpleQueue()
+    writer = logging.StreamHandler()
+    writer.setFormatter(logging.Formatter(FORMAT))
+    listener = logging.handlers.QueueListener(records, writer)
+
+    root = logging.getLogger()
+    root.handlers[:] = [_DeferredQueueHandler(records)]
+    root.setLevel(level)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+class Sampler:
+    """
+    Lets the first occurrence of each event through and then one out of every `every`
+    """
+
+    def __init__(self, every: int = 100):
+        self._every = max(every, 1)
+        self._seen = {}
+
+    def __call__(self, event: str):
+        seen = self._seen.get(event, 0)
+        self._seen[event] = seen + 1
+        return seen % self._every == 0
+
+    def seen(self, event: str):
+        return self._seen.get(event, 0)
+
+
+class RecentInputs:
+    """
+    Ring buffer of the latest requests, dumped when a handler raises
+    """
+
+    def __init__(self, size: int = 32):
+        self._requests = deque(maxlen=size)
+
+    def add(self, request):
+        self._requests.append(request)
+
+    def dump(self, logger: logging.Logger):
+        logger.error("Last %d requests before the failure:", len(self._requests))
+        for request in self._requests:
+            logger.error("%s", _Json(request))
+
+
+class _Json:
+    """
+    Defers the JSON encoding of a log argument to the writer thread
+    """
+
+    __slots__ = ("_value",)
+
+    def __init__(self, value):
+        self._value = value
+
+    def __str__(self):
+        return json.dumps(self._value)
@@ -0,0 +1,218 @@
+# Copyright 2022 Cartesi Pte. Ltd.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy of the
+# License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+"""
+In-process metrics and profiling hooks
+
+Counters, latency histograms and gauges are kept in memory and read through the `metrics`
+inspect query. Setting WEREWOLF_PROFILE to `cprofile` profiles every handler call and writes
+the stats to WEREWOLF_PROFILE_OUT, setting it to `sample` samples the main thread's stack
+every WEREWOLF_PROFILE_INTERVAL seconds and reports the hottest functions along with the metrics.
+"""
+
+import atexit
+import bisect
+import cProfile
+import functools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# histogram bucket upper bounds in seconds, from 10us to about 10s
+BUCKETS = tuple(10e-6 * 2 ** i for i in range(21))
+
+
+class Histogram:
+    """
+    Latency distribution over fixed, exponentially growing buckets
+    """
+
+    __slots__ = ("count", "total", "max", "_buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._buckets = [0] * (len(BUCKETS) + 1)
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self._buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+
+    def percentile(self, p: float):
+        """
+        Upper bound of the bucket holding the given percentile
+        """
+        if not self.count:
+            return 0.0
+        rank = p * self.count
+        seen = 0
+        for i, n in enumerate(self._buckets):
+            seen += n
+            if seen >= rank:
+                return min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+        return self.max
+
+    def as_dict(self):
+        return {"count": self.count, "mean": self.total / self.count if self.count else 0.0,
+                "p50": self.percentile(0.5), "p99": self.percentile(0.99), "max": self.max}
+
+
+class Metrics:
+
+    def __init__(self):
+        self._counters = Counter()
+        self._histograms = {}
+        self._gauges = {}
+        self._profiler = None
+
+    def count(self, name: str, n: int = 1):
+        self._counters[name] += n
+
+    def observe(self, name: str, seconds: float):
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            histogram = self._histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+    def gauge(self, name: str, read):
+        """
+        Register a gauge, read is called whenever the metrics are read
+        """
+        self._gauges[name] = read
+
+    def timed(self, name: str):
+        """
+        Decorate a function so that the latency of its calls goes to the named histogram
+        """
+        def decorate(f):
+            @functools.wraps(f)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - start)
+            return wrapper
+        return decorate
+
+    def profile(self, profiler):
+        self._profiler = profiler
+
+    def snapshot(self):
+        result = {
+            "counters": dict(sorted(self._counters.items())),
+            "latencies": {name: h.as_dict() for name, h in sorted(self._histograms.items())},
+            "gauges": {name: read() for name, read in sorted(self._gauges.items())},
+        }
+        if self._profiler is not None:
+            result["profile"] = self._profiler.summary()
+        return result
+
+
+class CProfileHook:
+    """
+    Deterministic profiler enabled around handler calls only, so that idle polling is left out
+    """
+
+    def __init__(self, path: str, every: int = 100):
+        self._profile = cProfile.Profile()
+        self._path = path
+        self._every = every
+        self._calls = 0
+        atexit.register(self.dump)
+
+    def __enter__(self):
+        self._profile.enable()
+
+    def __exit__(self, *exc):
+        self._profile.disable()
+        self._calls += 1
+        if self._calls % self._every == 0:
+            self.dump()
+
+    def dump(self):
+        self._profile.dump_stats(self._path)
+
+    def summary(self):
+        return {"mode": "cprofile", "calls": self._calls, "path": self._path}
+
+
+class SamplingHook:
+    """
+    Statistical profiler counting the function on top of the main thread's stack
+    """
+
+    def __init__(self, interval: float = 0.005, top: int = 20):
+        self._interval = interval
+        self._top = top
+        self._samples = Counter()
+        self._busy = False
+        self._thread_id = threading.main_thread().ident
+        threading.Thread(target=self.__run, daemon=True).start()
+
+    def __enter__(self):
+        self._busy = True
+
+    def __exit__(self, *exc):
+        self._busy = False
+
+    def __run(self):
+        while True:
+            time.sleep(self._interval)
+            if not self._busy:
+                continue
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                code = frame.f_code
+                self._samples[f"{code.co_filename}:{code.co_name}:{frame.f_lineno}"] += 1
+
+    def summary(self):
+        total = sum(self._samples.values())
+        return {"mode": "sample", "samples": total,
+                "top": [[where, n] for where, n in self._samples.most_common(self._top)]}
+
+
+class _NoProfile:
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+def profile_hook(metrics: Metrics, mode: str = None):
+    """
+    Return a context manager profiling what runs inside it, as WEREWOLF_PROFILE selects
+    """
+    mode = mode if mode is not None else os.environ.get("WEREWOLF_PROFILE", "")
+    if mode == "cprofile":
+        hook = CProfileHook(os.environ.get("WEREWOLF_PROFILE_OUT", "werewolf.prof"))
+    elif mode == "sample":
+        hook = SamplingHook(float(os.environ.get("WEREWOLF_PROFILE_INTERVAL", 0.005)))
+    elif mode == "":
+        return _NoProfile()
+    else:
+        raise ValueError(f"unknown profile mode {mode}")
+    metrics.profile(hook)
+    return hook
+
+
+# metrics of this process
+METRICS = Metrics()
+timed = METRICS.timed
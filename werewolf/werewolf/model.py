@@ -10,27 +10,64 @@
 # CONDITIONS OF ANY KIND, either express or implied. See the License for the
 # specific language governing permissions and limitations under the License.
 
+from collections import deque
 from enum import Enum
-import rsa
-import jsonpickle
+import hashlib
 import json
 import random
+from werewolf import codec
+from werewolf.cipher import get_cipher
+from werewolf.inputs import FINISH_PREFIX, Input, Op
+from werewolf.metrics import timed
+from werewolf.movelog import MoveLog
+from werewolf.roles import check_key, decrypt_roles
 
 Role = Enum("Role", ["MODERATOR", "WEREWOLF", "VILLAGER", "UNKNOWN"])
+# phases of a game, the handler of an input is looked up by phase and opcode
+Phase = Enum("Phase", ["JOINING", "DISPATCHING", "NIGHT", "DAY", "OVER"])
 # 1 werewolf, 4 villagers, 1 moderator
 NUMBER_OF_PLAYER = 6
+# number of state versions a delta inspect can reach back to
+JOURNAL_SIZE = 64
+# journal entry of the changes that touched every player
+EVERYONE = "*"
+
+
+class Epochs:
+    """
+    Round counters shared by the players of a game
+
+    A player has moved or voted when it did so in the current epoch, so bumping an epoch
+    resets every player at once. While ballot holds the tied candidates of a revote, only
+    they can be voted.
+    """
+
+    __slots__ = ("move", "vote", "ballot")
+
+    def __init__(self):
+        self.move = 0
+        self.vote = 0
+        self.ballot = None
 
 
 class Player:
     """
     Werewolf player
 
-    Encapsulates player status
+    Encapsulates player status, stored in slots to keep large tables small
     """
 
-    def __init__(self, id: str, pub_key: str):
+    __slots__ = ("_id", "_pub_key", "_epochs", "_role", "_alive", "_can_be_voted",
+                 "_moved_at", "_voted_at", "_votes_at", "_votes_got", "_encrypted_role")
+
+    def __init__(self, id: str, pub_key: str, epochs: Epochs = None):
         self._id = id
         self._pub_key = pub_key
+        self._epochs = epochs or Epochs()
+        self._moved_at = -1
+        self._voted_at = -1
+        self._votes_at = -1
+        self._votes_got = 0
 
         self.role = Role.UNKNOWN
         self.alive = True
@@ -46,7 +83,8 @@ class Player:
 
     @property
     def can_be_voted(self):
-        return self._can_be_voted
+        ballot = self._epochs.ballot
+        return self._can_be_voted and (ballot is None or self._id in ballot)
 
     @property
     def encrypted_role(self):
@@ -54,11 +92,11 @@ class Player:
 
     @property
     def has_moved(self):
-        return self._has_moved
+        return self._moved_at == self._epochs.move
 
     @property
     def has_voted(self):
-        return self._has_voted
+        return self._voted_at == self._epochs.vote
 
     @property
     def pub_key(self):
@@ -66,7 +104,7 @@ class Player:
 
     @property
     def votes_got(self):
-        return self._votes_got
+        return self._votes_got if self._votes_at == self._epochs.vote else 0
 
     @property
     def id(self):
@@ -90,7 +128,7 @@ class Player:
 
     @has_moved.setter
     def has_moved(self, has_moved: bool):
-        self._has_moved = has_moved
+        self._moved_at = self._epochs.move if has_moved else -1
 
     @pub_key.setter
     def pub_key(self, pub_key):
@@ -98,10 +136,11 @@ class Player:
 
     @has_voted.setter
     def has_voted(self, has_voted: bool):
-        self._has_voted = has_voted
+        self._voted_at = self._epochs.vote if has_voted else -1
 
     @votes_got.setter
     def votes_got(self, votes_got: int):
+        self._votes_at = self._epochs.vote
         self._votes_got = votes_got
 
     @role.setter
@@ -112,29 +151,42 @@ class Player:
         if self.role == Role.MODERATOR:
             raise ValueError("moderator cannot move")
 
-        if self._has_moved:
+        if self.has_moved:
             raise ValueError("player has already moved")
 
-        self._has_moved = True
+        self.has_moved = True
 
     def vote(self, candidate):
         if self.role == Role.MODERATOR:
             raise ValueError("moderator cannot vote")
 
-        if self._has_voted:
+        if self.has_voted:
             raise ValueError("voter has already voted")
 
-        if not candidate._can_be_voted:
+        if not candidate.can_be_voted:
             raise ValueError("candidate cannot be voted")
 
-        self._has_voted = True
-        candidate._votes_got += 1
+        self.has_voted = True
+        candidate.votes_got += 1
 
-        return candidate._votes_got
+        return candidate.votes_got
 
     def reset_vote(self):
-        self._has_voted = False
-        self._votes_got = 0
+        self.has_voted = False
+        self.votes_got = 0
+
+    def snapshot(self):
+        return [self._id, self._pub_key, self._role.name, self._alive, self._can_be_voted,
+                self._moved_at, self._voted_at, self._votes_at, self._votes_got,
+                self._encrypted_role]
+
+    @classmethod
+    def restore(cls, state, epochs: Epochs):
+        player = cls(state[0], state[1], epochs)
+        (_, _, role, player._alive, player._can_be_voted, player._moved_at, player._voted_at,
+         player._votes_at, player._votes_got, player._encrypted_role) = state
+        player._role = Role[role]
+        return player
 
     def print(self):
         print(f"""player {self.id} plays {self.role}, alive: {self.alive}, has_moved: {self.has_moved},
@@ -150,24 +202,167 @@ class Game:
     The remaining villagers try to vote out the suspicious werewolf, who will be killed based on the vote.
     When there's a tie, revote is required.
     The game ends when all players from one party are all killed.
+
+    Every input that changes the state bumps the state version, the journal remembers which
+    players each recent version touched so that clients can fetch deltas instead of the whole state.
+
+    Votes are tallied as they come, and moves and votes are reset for everyone at once by moving
+    to the next epoch, so that no step walks every player.
     """
 
-    def __init__(self):
+    def __init__(self, id: int = 0, number_of_players: int = NUMBER_OF_PLAYER):
+        if number_of_players < 4:
+            raise ValueError("a game needs at least 4 players")
+
+        self._id = id
+        self._number_of_players = number_of_players
         self.__reset()
 
     def __reset(self):
+        self._version = 0
+        self._journal = deque(maxlen=JOURNAL_SIZE)
+        self._touched = set()
         self._started = False
         self._is_daytime = True
         self._rounds = 0
         self._players = {}
-        self._move_history = []
+        self._epochs = Epochs()
+        self._move_log = MoveLog()
+        self._events = []
+        self._revealed = {}
+        self._unverified = []
         self._moves = 0
         self._votes = 0
+        self._top_votes = 0
+        self._leaders = set()
         self._alives = {}
         self._moderator = ""
         self._werewolf = ""
         self._game_result = ""
 
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def number_of_players(self):
+        return self._number_of_players
+
+    @property
+    def is_full(self):
+        return len(self._players) == self._number_of_players
+
+    @property
+    def phase(self):
+        if not self._started:
+            return Phase.DISPATCHING if self.is_full else Phase.JOINING
+        if self._game_result != "":
+            return Phase.OVER
+        return Phase.DAY if self._is_daytime else Phase.NIGHT
+
+    def __scalars(self):
+        return (self._started, self._is_daytime, self._rounds, self._moves, self._votes,
+                self._moderator, self._werewolf, self._game_result, len(self._alives))
+
+    def __touch(self, *ids):
+        self._touched.update(ids)
+
+    def __commit(self, scalars, moves: int):
+        if not self._touched and moves == self._move_log.appended and scalars == self.__scalars():
+            return
+
+        self._version += 1
+        self._journal.append((self._version, frozenset(self._touched), moves))
+        self._touched = set()
+
+    def pop_notices(self):
+        """
+        Return the notices produced since the last call, the events of an input are coalesced
+        into a single notice and an input without events produces none
+        """
+        events, self._events = self._events, []
+        return [codec.encode_notice(self, events)] if events else []
+
+    def moves(self, round: int):
+        return self._move_log.moves(round)
+
+    def snapshot(self):
+        """
+        Plain, deterministic copy of the state, the journal is left out and clients of a
+        restored game fall back to full inspects
+        """
+        return {
+            "id": self._id,
+            "number_of_players": self._number_of_players,
+            "version": self._version,
+            "started": self._started,
+            "is_daytime": self._is_daytime,
+            "rounds": self._rounds,
+            "epochs": [self._epochs.move, self._epochs.vote,
+                       None if self._epochs.ballot is None else sorted(self._epochs.ballot)],
+            "moves": self._moves,
+            "votes": self._votes,
+            "top_votes": self._top_votes,
+            "leaders": sorted(self._leaders),
+            "alives": sorted(self._alives),
+            "moderator": self._moderator,
+            "werewolf": self._werewolf,
+            "game_result": self._game_result,
+            "players": [p.snapshot() for p in self._players.values()],
+            "move_log": self._move_log.snapshot(),
+            "revealed": [[id, key] for id, key in self._revealed.items()],
+            "unverified": self._unverified,
+        }
+
+    @classmethod
+    def restore(cls, state):
+        game = cls(state["id"], state["number_of_players"])
+        game._version = state["version"]
+        game._started = state["started"]
+        game._is_daytime = state["is_daytime"]
+        game._rounds = state["rounds"]
+        move, vote, ballot = state["epochs"]
+        game._epochs.move = move
+        game._epochs.vote = vote
+        game._epochs.ballot = None if ballot is None else set(ballot)
+        game._moves = state["moves"]
+        game._votes = state["votes"]
+        game._top_votes = state["top_votes"]
+        game._leaders = set(state["leaders"])
+        game._alives = set(state["alives"])
+        game._moderator = state["moderator"]
+        game._werewolf = state["werewolf"]
+        game._game_result = state["game_result"]
+        for p in state["players"]:
+            player = Player.restore(p, game._epochs)
+            game._players[player.id] = player
+        game._move_log = MoveLog.restore(state["move_log"])
+        game._revealed = dict(state["revealed"])
+        game._unverified = list(state["unverified"])
+        return game
+
+    def changes_since(self, version: int):
+        """
+        Return the players touched after the given version and the number of moves appended at that version,
+        or None when the journal does not reach back that far. EVERYONE stands for all players.
+        """
+        if version > self._version:
+            return None
+
+        touched = set()
+        moves = self._move_log.appended
+        for v, ids, moves_before in reversed(self._journal):
+            if v <= version:
+                return touched, moves
+            touched.update(ids)
+            moves = moves_before
+
+        if self._journal and self._journal[0][0] > version + 1:
+            return None
+        if not self._journal and version != self._version:
+            return None
+        return touched, moves
+
     def __try_get_player(self, id: str):
         return self._players.get(id)
 
@@ -185,9 +380,8 @@ class Game:
     def __toggle_day(self):
         self._is_daytime = not self._is_daytime
         self._moves = 0
-        for v in self._alives:
-            player = self.__get_player(v)
-            player.has_moved = False
+        self._epochs.move += 1
+        self.__touch(EVERYONE)
 
         if self._is_daytime:
             self.__advance()
@@ -200,14 +394,20 @@ class Game:
 
         victim.alive = False
         self._alives.remove(victim_id)
+        self.__touch(victim_id)
 
         self.__toggle_day()
 
-    def new_player(self, data):
-        id = data["metadata"]["msg_sender"].upper()
-        pub_key = data["payload"]
+    @timed("game.new_player")
+    def new_player(self, input: Input):
+        id = input.sender
+        pub_key = input.payload.hex()
+        try:
+            get_cipher().load_public(input.payload)
+        except Exception:
+            raise ValueError("invalid public key") from None
 
-        if len(self._players) >= NUMBER_OF_PLAYER:
+        if len(self._players) >= self._number_of_players:
             raise ValueError("game is full, please join the next one")
 
         if self._started:
@@ -216,100 +416,230 @@ class Game:
         if self.__try_get_player(id) is not None:
             raise ValueError("player already joined")
 
-        self._players[id] = Player(id, pub_key)
+        self._players[id] = Player(id, pub_key, self._epochs)
+        self.__touch(id)
+        event = [codec.JOINED, id, ""]
+        self._events.append(event)
 
-        if len(self._players) == NUMBER_OF_PLAYER:
+        if self.is_full:
             # TODO: select one player to be the moderator
             # moderator should assign roles to other player
-            moderator = random.choice(list(self._players.keys()))
+            # seeded by the players' keys so that replaying the inputs picks the same moderator
+            seed = hashlib.sha256("".join(
+                p.id + p.pub_key for p in self._players.values()).encode()).digest()
+            moderator = random.Random(seed).choice(list(self._players.keys()))
             # print(f"moderator: {moderator}")
 
             self._players[moderator].role = Role.MODERATOR
             self._players[moderator].can_be_voted = False
             self._moderator = moderator
-
+            self.__touch(moderator)
+            event[2] = moderator
+
+    def __decrypt(self, ids):
+        roles = decrypt_roles([(id, self._players[id].pub_key, self._revealed[id],
+                                self._players[id].encrypted_role) for id in ids])
+        if any(role not in ("WEREWOLF", "VILLAGER") for role in roles.values()):
+            raise ValueError("invalid role")
+        return roles
+
+    def __decrypts(self, id: str):
+        try:
+            self.__decrypt([id])
+            return True
+        except Exception:
+            return False
+
+    def __werewolf_of(self, roles):
+        """
+        The werewolf once the given decrypted roles are known, empty while still unknown
+        """
+        werewolves = {id for id, role in roles.items() if role == "WEREWOLF"}
+        if len(werewolves | ({self._werewolf} if self._werewolf else set())) > 1:
+            raise ValueError("more than one werewolf")
+        return werewolves.pop() if werewolves else self._werewolf
+
+    def __apply(self, roles, werewolf: str):
+        for id, role in roles.items():
+            self._players[id].role = Role[role]
+        self.__touch(*roles.keys())
+        self._werewolf = werewolf
+
+    def __verify(self, ids):
+        """
+        Decrypt the roles of the given players with the keys they revealed, all at once
+        """
+        roles = self.__decrypt(ids)
+        self.__apply(roles, self.__werewolf_of(roles))
+        return roles
+
+    def __reveal(self, player, key: str):
+        if player.role == Role.MODERATOR or player.encrypted_role == "":
+            raise ValueError("player has no role to reveal")
+        if player.id in self._revealed:
+            raise ValueError("player already revealed its key")
+        self._revealed[player.id] = key
+
+    def handle_reveal(self, input: Input):
+        player = self.__get_player(input.sender)
+        if self._game_result == "" and player.alive:
+            raise ValueError("only dead players reveal their key before the result")
+        self.reveal_role(player, input.payload.hex())
+
+    @timed("game.reveal_role")
     def reveal_role(self, player, payload):
-        key = rsa.PrivateKey.load_pkcs1(bytes.fromhex(payload), "DER")
-        role = rsa.decrypt(bytes.fromhex(player.encrypted_role), key)
-        player.role = role
-        if role == Role.WEREWOLF:
-            self._werewolf = player.id
-
-    def finish(self):  # def finish(self, payload):
-        if len(self._werewolf) == 0 and len(self._alives) == 2:
-            self._game_result = "WEREWOLF WIN!!!"
-        elif len(self._werewolf) != 0 and self._werewolf not in self._alives:
-            self._game_result = "VILLAGER WIN!!!"
-        else:
-            print("game is not finished")
-
-        # private_keys_dict = json.loads(bytes.fromhex(payload).decode())
-        # # TODO: replay the game with moderator key revealed
-
-        # # decrypt everyone's role
-        # for p, der in private_keys_dict.items():
-        #     player = self.__get_player(p)
-        #     if player.role == Role.MODERATOR:
-        #         continue
-
-        #     key = rsa.PrivateKey.load_pkcs1(bytes.fromhex(der), "DER")
-        #     role = rsa.decrypt(bytes.fromhex(player.encrypted_role), key)
-
-        #     if role == b"WEREWOLF":
-        #         player.role = Role.WEREWOLF
-        #         self._werewolf = p
-        #     elif role == b"VILLAGER":
-        #         player.role = Role.VILLAGER
-        #     else:
-        #         raise ValueError("invalid role")
-
-        # werewolf = self.__get_player(self._werewolf)
-        # alives = len(self._alives)
-        # if alives > 2 and not werewolf.alive:
-        #     self._game_result = "VILLAGER WIN!!!"
-        #     # print("VILLAGER WIN!!!")
-        # elif alives == 2 and werewolf.alive:
-        #     self._game_result = "WEREWOLF WIN!!!"
-        #     # print("WEREWOLF WIN!!!")
-        # else:
-        #     raise ValueError("game is not finished")
-
-        # self.__reset()
-
-    def handle_inspect(self):
-        state = jsonpickle.encode(self, keys=True)
-        return state
-
-    def handle_advance(self, data):
-        if not self._started:
-            if len(self._players) == NUMBER_OF_PLAYER:
-                self.dispatch_roles(data)
-            else:
-                self.new_player(data)
-        else:
-            player_id = data["metadata"]["msg_sender"].upper()
-            player = self.__get_player(player_id)
-            if self._game_result != "":
-                self.reveal_role(player, data["payload"])
-            elif player_id not in self._alives and player.role == Role.UNKNOWN:
-                self.reveal_role(player, data["payload"])
-                # "finish" = "0x66696e697368"
-            elif data["payload"][:12] == "66696e697368":
-                # self.finish(data["payload"][12:])
-                self.finish()
-            elif self._is_daytime:
-                self.handle_vote(data)
-            else:
-                self.handle_night(data)
-
-    def handle_night(self, data):
-        if data["metadata"]["msg_sender"].upper() == self._moderator:
-            self.handle_kill(bytes.fromhex(data["payload"]).decode())
-        else:
-            self.handle_move(data)
-
-    def handle_move(self, data):
-        player_id = data["metadata"]["msg_sender"].upper()
+        self.__reveal(player, payload)
+        if self._game_result == "":
+            # a dead player's role decides whether the game goes on
+            try:
+                roles = self.__verify([player.id])
+            except Exception:
+                del self._revealed[player.id]
+                raise
+            self._events.append([codec.REVEALED, player.id, roles[player.id]])
+            return
+
+        # the outcome is settled, the remaining roles are decrypted together once all keys are
+        # in, each key is only checked against its public key as it comes
+        try:
+            check_key(player.id, player.pub_key, payload)
+        except Exception:
+            del self._revealed[player.id]
+            raise
+        self._unverified.append(player.id)
+        if len(self._revealed) < len(self._players) - 1:
+            return
+
+        try:
+            try:
+                self.__verify(self._unverified)
+            except Exception:
+                # the keys are genuine, roles that do not decrypt with them stay unknown
+                # rather than failing the batch for whoever revealed last
+                failed = {id for id in self._unverified if not self.__decrypts(id)}
+                if not failed:
+                    raise
+                self.__verify([id for id in self._unverified if id not in failed])
+        except Exception:
+            self._unverified.pop()
+            del self._revealed[player.id]
+            raise
+        self._unverified = []
+
+        # a dead werewolf that only revealed after the result overturns it
+        outcome = self.__outcome()
+        if outcome != self._game_result:
+            self.__announce(outcome)
+
+    def __outcome(self, werewolf: str = None):
+        werewolf = self._werewolf if werewolf is None else werewolf
+        if werewolf != "" and werewolf not in self._alives:
+            return "VILLAGER WIN!!!"
+        if len(self._alives) == 2:
+            return "WEREWOLF WIN!!!"
+        return ""
+
+    def handle_finish(self, input: Input):
+        self.__get_player(input.sender)
+        if input.sender != self._moderator:
+            raise ValueError("only the moderator finishes the game")
+        payload = input.payload
+        if input.opcode is None:
+            payload = payload[len(FINISH_PREFIX):]
+        self.finish(payload)
+
+    @timed("game.finish")
+    def finish(self, payload: bytes = b""):
+        """
+        Settle the game, payload optionally holds more private keys as a JSON object
+
+        Every key revealed so far that was not checked yet is verified in one batch along with
+        the given ones, then the outcome is validated and announced in a single notice. Nothing
+        is kept of the keys and roles when the game turns out not to be over.
+        """
+        keys = json.loads(payload) if payload else {}
+        if not isinstance(keys, dict):
+            raise ValueError("keys must be an object mapping players to private keys")
+
+        ids = []
+        try:
+            for id, key in keys.items():
+                player = self.__get_player(id.upper())
+                # the moderator has no role, and keys revealed before are not taken again
+                if player.id == self._moderator or player.id in self._revealed:
+                    continue
+                self.__reveal(player, key)
+                ids.append(player.id)
+            roles = self.__decrypt(ids)
+            werewolf = self.__werewolf_of(roles)
+            result = self.__outcome(werewolf)
+            if result == "":
+                raise ValueError("game is not finished")
+        except Exception:
+            for id in ids:
+                del self._revealed[id]
+            raise
+
+        self.__apply(roles, werewolf)
+        self.__announce(result)
+
+    def __announce(self, result: str):
+        self._game_result = result
+        self._events.append([codec.FINISHED, result,
+                             [[id, self._players[id].role.name] for id in self._revealed]])
+
+    def handle_inspect(self, since: int = None):
+        if since is not None:
+            changes = self.changes_since(since)
+            if changes is not None:
+                touched, moves = changes
+                if EVERYONE in touched:
+                    touched = self._players.keys()
+                return codec.encode_delta(self, touched, moves)
+
+        return codec.encode_game(self)
+
+    def handle_advance(self, input: Input):
+        scalars = self.__scalars()
+        moves = self._move_log.appended
+        try:
+            self.__handle_advance(input)
+        finally:
+            self.__commit(scalars, moves)
+
+    def __handle_advance(self, input: Input):
+        phase = self.phase
+        opcode = self.opcode_of(input)
+        handler = HANDLERS.get((phase, opcode))
+        if handler is None:
+            raise ValueError(f"{opcode.name.lower()} is not expected while {phase.name.lower()}")
+        handler(self, input)
+
+    def opcode_of(self, input: Input):
+        """
+        Opcode of the input, resolved from the phase and the sender's seat for legacy inputs
+        """
+        if input.opcode is not None:
+            return input.opcode
+
+        phase = self.phase
+        if phase is Phase.JOINING:
+            return Op.JOIN
+        if phase is Phase.DISPATCHING:
+            return Op.DISPATCH
+        player = self.__get_player(input.sender)
+        if phase is Phase.OVER or (input.sender not in self._alives and
+                                   player.role == Role.UNKNOWN):
+            return Op.REVEAL
+        if input.payload.startswith(FINISH_PREFIX):
+            return Op.FINISH
+        if phase is Phase.DAY:
+            return Op.VOTE
+        return Op.KILL if input.sender == self._moderator else Op.MOVE
+
+    @timed("game.handle_move")
+    def handle_move(self, input: Input):
+        player_id = input.sender
 
         player = self.__get_player(player_id)
 
@@ -318,11 +648,13 @@ class Game:
 
         player.move()
         self._moves += 1
-        self._move_history.append(data)
+        self._move_log.append(self._rounds, player.id, input.payload)
+        self.__touch(player_id)
 
-    def handle_vote(self, data):
-        voter_id = data["metadata"]["msg_sender"].upper()
-        candidate_id = bytes.fromhex(data["payload"]).decode()
+    @timed("game.handle_vote")
+    def handle_vote(self, input: Input):
+        voter_id = input.sender
+        candidate_id = input.payload.decode()
 
         voter = self.__get_player(voter_id)
 
@@ -334,55 +666,74 @@ class Game:
         if not candidate.alive:
             raise ValueError("candidate already died")
 
-        voter.vote(candidate)
+        votes_got = voter.vote(candidate)
         self._votes += 1
+        self.__touch(voter_id, candidate_id)
+
+        # keep track of the most voted candidates as votes come
+        if votes_got > self._top_votes:
+            self._top_votes = votes_got
+            self._leaders = {candidate_id}
+        elif votes_got == self._top_votes:
+            self._leaders.add(candidate_id)
 
         if self._votes == len(self._alives):
-            # sort the votes of alives in decending order
-            alives = list(
-                filter(lambda p: p.alive, self._players.values()))
-            alives.sort(
-                key=lambda p: p.votes_got, reverse=True)
-            highest = alives[0].votes_got
-            highest_candidate = alives[0].id
-
-            highest_ties = list(
-                filter(lambda p: p.votes_got == highest, alives))
-            if len(highest_ties) > 1:
-                print("revote!")
-                self._votes = 0
-                # more than one highest vote, requires revote
-                for v in alives:
-                    self._players[v._id].can_be_voted = False
-                    self._players[v._id].votes_got = 0
-                    self._players[v._id].has_voted = False
-
-                for tie in highest_ties:
-                    self._players[tie._id].can_be_voted = True
+            leaders = self._leaders
+            self._votes = 0
+            self._top_votes = 0
+            self._leaders = set()
+            self._epochs.vote += 1
+            self.__touch(EVERYONE)
+
+            if len(leaders) > 1:
+                # more than one highest vote, requires revote among them
+                self._epochs.ballot = leaders
+                self._events.append([codec.VOTED, self._rounds, "", sorted(leaders)])
             else:
-                for v in alives:
-                    self._players[v._id].can_be_voted = True
-                    self._players[v._id].votes_got = 0
-                    self._players[v._id].has_voted = False
-                self.__kill(highest_candidate)
+                self._epochs.ballot = None
+                voted_out = leaders.pop()
+                self._events.append([codec.VOTED, self._rounds, voted_out, []])
+                self.__kill(voted_out)
+
+    @timed("game.handle_kill")
+    def handle_kill(self, input: Input):
+        if input.sender != self._moderator:
+            raise ValueError("only moderator can kill")
 
-    def handle_kill(self, victim_id: str):
         if self._moves != len(self._alives):
             raise ValueError("everyone has to make a move")
 
+        round = self._rounds
+        victim_id = input.payload.decode()
         self.__kill(victim_id)
+        # the moderator has read the night's moves, archive them
+        self._events.append([codec.KILLED, round, victim_id])
+        self._events.append(codec.moves_event(round, self._move_log.close(round)))
 
-    def dispatch_roles(self, data):
-        if data["metadata"]["msg_sender"].upper() != self._moderator:
+    @timed("game.dispatch_roles")
+    def dispatch_roles(self, input: Input):
+        if input.sender != self._moderator:
             raise ValueError("only moderator can dispatch roles")
 
-        encrypted_roles = json.loads(bytes.fromhex(data["payload"]).decode())
+        encrypted_roles = json.loads(input.payload)
+        if not isinstance(encrypted_roles, dict) or not encrypted_roles:
+            raise ValueError("roles must be an object mapping players to encrypted roles")
+        # check everything first, players keep their encrypted role as hex for good
+        for p, e in encrypted_roles.items():
+            if p == self._moderator:
+                raise ValueError("moderator cannot get a role")
+            self.__get_player(p)
+            if not isinstance(e, str) or not e:
+                raise ValueError(f"encrypted role of {p} is not hex")
+            bytes.fromhex(e)
 
         for p, e in encrypted_roles.items():
             self.__get_player(p).encrypted_role = e
+        self.__touch(*encrypted_roles.keys())
 
         self._alives = set(list(encrypted_roles.keys()))
         self._started = True
+        self._events.append([codec.DISPATCHED, len(encrypted_roles)])
         self.__toggle_day()
 
     def print(self):
@@ -393,6 +744,21 @@ class Game:
             p.print()
 
 
+# handler of the inputs each phase expects, by phase and opcode
+HANDLERS = {
+    (Phase.JOINING, Op.JOIN): Game.new_player,
+    (Phase.DISPATCHING, Op.DISPATCH): Game.dispatch_roles,
+    (Phase.NIGHT, Op.MOVE): Game.handle_move,
+    (Phase.NIGHT, Op.KILL): Game.handle_kill,
+    (Phase.NIGHT, Op.REVEAL): Game.handle_reveal,
+    (Phase.NIGHT, Op.FINISH): Game.handle_finish,
+    (Phase.DAY, Op.VOTE): Game.handle_vote,
+    (Phase.DAY, Op.REVEAL): Game.handle_reveal,
+    (Phase.DAY, Op.FINISH): Game.handle_finish,
+    (Phase.OVER, Op.REVEAL): Game.handle_reveal,
+}
+
+
 # # testing below ##
 
 
@@ -0,0 +1,95 @@
+# Copyright 2022 Cartesi Pte. Ltd.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy of the
+# License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+
+class Segment:
+    """
+    Moves of one night, start is the index of its first move in the whole log
+    """
+
+    __slots__ = ("round", "start", "moves")
+
+    def __init__(self, round: int, start: int):
+        self.round = round
+        self.start = start
+        self.moves = []
+
+
+class MoveLog:
+    """
+    Night moves, segmented and indexed by round
+
+    Each move only keeps its sender and ciphertext. Once the moderator has read a night's
+    moves its segment is closed, handed over for archiving and dropped from the live log.
+    """
+
+    __slots__ = ("_segments", "_appended")
+
+    def __init__(self):
+        self._segments = {}
+        self._appended = 0
+
+    @property
+    def appended(self):
+        """
+        Number of moves ever appended, live or archived
+        """
+        return self._appended
+
+    def __len__(self):
+        return sum(len(s.moves) for s in self._segments.values())
+
+    @property
+    def rounds(self):
+        return list(self._segments)
+
+    def append(self, round: int, sender: str, payload: bytes):
+        segment = self._segments.get(round)
+        if segment is None:
+            segment = self._segments[round] = Segment(round, self._appended)
+        segment.moves.append((sender, payload))
+        self._appended += 1
+
+    def moves(self, round: int):
+        segment = self._segments.get(round)
+        return segment.moves if segment is not None else []
+
+    def since(self, index: int):
+        """
+        Live moves appended at or after the given index, as (round, sender, payload)
+        """
+        for segment in self._segments.values():
+            end = segment.start + len(segment.moves)
+            if end <= index:
+                continue
+            for sender, payload in segment.moves[max(0, index - segment.start):]:
+                yield segment.round, sender, payload
+
+    def close(self, round: int):
+        """
+        Drop the segment of a round from the live log and return its moves
+        """
+        segment = self._segments.pop(round, None)
+        return segment.moves if segment is not None else []
+
+    def snapshot(self):
+        return [[s.round, s.start, [[sender, payload.hex()] for sender, payload in s.moves]]
+                for s in self._segments.values()] + [self._appended]
+
+    @classmethod
+    def restore(cls, state):
+        log = cls()
+        *segments, log._appended = state
+        for round, start, moves in segments:
+            segment = log._segments[round] = Segment(round, start)
+            segment.moves = [(sender, bytes.fromhex(payload)) for sender, payload in moves]
+        return log
@@ -1,17 +1,307 @@
+import asyncio
+import json
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+import requests
+from werewolf.codec import decode_game, decode_report
 
+DEPLOYMENTS = os.path.join(os.path.dirname(__file__), "..", "..", "deployments", "localhost")
+# bytes4(keccak256("addInput(address,bytes)"))
+ADD_INPUT_SELECTOR = "1789cd63"
+# seconds between blocks, waits back off to no longer than that between two inspects
+BLOCK_TIME = 1.0
 
-import subprocess
-import jsonpickle
-from werewolf.model import Game
 
+def _deployed_address(name: str):
+    with open(os.path.join(DEPLOYMENTS, f"{name}.json")) as f:
+        return json.load(f)["address"]
 
-class Network:
 
-    def send_on_chain(self, payload, account_index):
+def encode_add_input(dapp: str, payload: str):
+    """
+    ABI encode a call to InputBox.addInput(dapp, payload), payload is hex without 0x
+    """
+    length = len(payload) // 2
+    padding = "0" * (-len(payload) % 64)
+    return ("0x" + ADD_INPUT_SELECTOR + dapp[2:].lower().rjust(64, "0") +
+            f"{64:064x}" + f"{length:064x}" + payload + padding)
+
+
+class HttpTransport:
+    """
+    Native transport, inspects through the reader HTTP endpoint and sends inputs straight to
+    the InputBox contract through JSON-RPC, both over pooled connections
+
+    Inputs are sent from the node's own unlocked accounts, as the local hardhat node provides.
+    """
+
+    def __init__(self, inspect_url: str, rpc_url: str, input_box: str, dapp: str,
+                 confirmation_timeout: float = 60):
+        self._inspect_url = inspect_url.rstrip("/")
+        self._rpc_url = rpc_url
+        self._input_box = input_box
+        self._dapp = dapp
+        self._confirmation_timeout = confirmation_timeout
+        self._session = requests.Session()
+        self._accounts = None
+        self._rpc_id = 0
+
+    def __rpc(self, method: str, *params):
+        self._rpc_id += 1
+        response = self._session.post(self._rpc_url, json={
+            "jsonrpc": "2.0", "id": self._rpc_id, "method": method, "params": list(params)})
+        response.raise_for_status()
+        body = response.json()
+        if "error" in body:
+            raise RuntimeError(f"{method} failed: {body['error']}")
+        return body["result"]
+
+    def accounts(self):
+        """
+        Addresses of the node's unlocked accounts, by account index
+        """
+        if self._accounts is None:
+            self._accounts = self.__rpc("eth_accounts")
+        return self._accounts
+
+    def send(self, payload: str, account_index: int):
+        tx = self.__rpc("eth_sendTransaction", {
+            "from": self.accounts()[account_index],
+            "to": self._input_box,
+            "data": encode_add_input(self._dapp, payload),
+        })
+
+        deadline = time.monotonic() + self._confirmation_timeout
+        while self.__rpc("eth_getTransactionReceipt", tx) is None:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"input transaction {tx} was not confirmed")
+            time.sleep(0.2)
+
+    def inspect(self, payload: str):
+        response = self._session.get(f"{self._inspect_url}/{quote(payload)}")
+        response.raise_for_status()
+        result = response.json()
+        if result["status"] != "Accepted" or not result["reports"]:
+            raise RuntimeError(f"inspect {payload} failed with status {result['status']}")
+        return bytes.fromhex(result["reports"][0]["payload"][2:]).decode()
+
+
+class YarnTransport:
+    """
+    Fallback transport, spawns the frontend-console for every call
+    """
+
+    def send(self, payload: str, account_index: int):
         subprocess.check_output(['yarn', 'start', 'input', 'send',
                                 '--payload', "0x" + payload, '--accountIndex', str(account_index)], cwd="../frontend-console")
 
-    def inspect(self):
-        report = subprocess.check_output(
-            ['yarn', 'start', 'inspect', '--payload', 'xx', ], cwd="../frontend-console").decode().split("\n")[6].split(":", 1)[1]
-        return jsonpickle.decode(report, classes=Game)
+    def inspect(self, payload: str):
+        return subprocess.check_output(
+            ['yarn', 'start', 'inspect', '--payload', payload, ], cwd="../frontend-console").decode().split("\n")[6].split(":", 1)[1]
+
+
+def default_transport():
+    if os.environ.get("WEREWOLF_TRANSPORT", "http") == "yarn":
+        return YarnTransport()
+
+    return HttpTransport(
+        os.environ.get("INSPECT_URL", "http://localhost:5005/inspect"),
+        os.environ.get("RPC_URL", "http://localhost:8545"),
+        os.environ.get("INPUT_BOX_ADDRESS") or _deployed_address("InputBox"),
+        os.environ.get("DAPP_ADDRESS") or _deployed_address("dapp"))
+
+
+class _States:
+    """
+    Last known state of each inspected target, refreshed through deltas
+
+    Both networks inspect query(payload) and hand the report to decode until it returns a
+    state, so that the sync and async clients follow the same protocol.
+    """
+
+    def __init__(self):
+        self._states = {}
+
+    def query(self, payload: str):
+        """
+        Inspect payload refreshing the target, a delta request once a state of it is known
+        """
+        state = self._states.get(payload)
+        if "/" in payload or state is None:
+            return payload
+        return f"{payload}/since/{state.version}"
+
+    def decode(self, payload: str, report: str):
+        """
+        Decode the answer to query(payload), None when a snapshot has to be inspected instead
+
+        Payloads holding a query, such as `<address>/phase`, return the decoded projection.
+        """
+        if "/" in payload:
+            return decode_report(report)
+
+        base = self._states.get(payload)
+        try:
+            state = decode_game(report, base)
+        except ValueError:
+            if base is None:
+                raise
+            # the target moved to another game, start over from a snapshot
+            del self._states[payload]
+            return None
+        # a delta request answered with a snapshot brings a new state to build on
+        self._states[payload] = state
+        return state
+
+
+class _Backoff:
+    """
+    Polling intervals of wait_for, short right after the state changed and backing off while
+    it does not, predicate only runs on new versions
+    """
+
+    def __init__(self, predicate, min_interval: float, max_interval: float):
+        self._predicate = predicate
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._interval = min_interval
+        self._seen = None
+
+    def delay(self, state):
+        """
+        Seconds to wait before inspecting again, None once predicate holds for the state
+        """
+        seen = (state.id, state.version)
+        if seen != self._seen:
+            self._seen = seen
+            if self._predicate(state):
+                return None
+            self._interval = self._min_interval
+        delay = self._interval
+        self._interval = min(delay * 2, self._max_interval)
+        return delay
+
+
+class Network:
+
+    def __init__(self, transport=None, min_interval: float = 0.25,
+                 max_interval: float = BLOCK_TIME):
+        self._transport = transport or default_transport()
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._states = _States()
+
+    def send_on_chain(self, payload, account_index):
+        self._transport.send(payload, account_index)
+
+    def inspect(self, payload="xx"):
+        """
+        Return the game state, the state returned by a previous call is updated in place
+
+        Payloads holding a query, such as `<address>/phase`, return the decoded projection.
+        """
+        state = None
+        while state is None:
+            state = self._states.decode(payload,
+                                        self._transport.inspect(self._states.query(payload)))
+        return state
+
+    def wait_for(self, payload, predicate, timeout: float = None):
+        """
+        Return the game state as soon as predicate holds for it, or once timeout expires
+
+        The state is refreshed through delta inspects, polled more often right after it changed
+        and backing off while it does not, and predicate only runs on new versions.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        backoff = _Backoff(predicate, self._min_interval, self._max_interval)
+        state = self.inspect(payload)
+        delay = backoff.delay(state)
+        while delay is not None:
+            if deadline is not None and time.monotonic() >= deadline:
+                return state
+            time.sleep(delay)
+            state = self.inspect(payload)
+            delay = backoff.delay(state)
+
+        return state
+
+
+class AsyncNetwork:
+    """
+    Non-blocking counterpart of Network for asyncio clients
+
+    Transport calls run in a thread pool, each thread with a transport of its own, and the
+    coroutines inspecting the same payload at the same time share a single call.
+    """
+
+    def __init__(self, transport_factory=None, threads: int = 32, min_interval: float = 0.25,
+                 max_interval: float = BLOCK_TIME):
+        self._transport_factory = transport_factory or default_transport
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(threads)
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._states = _States()
+        self._inspecting = {}
+
+    def __transport(self):
+        transport = getattr(self._local, "transport", None)
+        if transport is None:
+            transport = self._local.transport = self._transport_factory()
+        return transport
+
+    async def __call(self, method: str, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, lambda: getattr(self.__transport(), method)(*args))
+
+    async def accounts(self):
+        return await self.__call("accounts")
+
+    async def send_on_chain(self, payload, account_index):
+        await self.__call("send", payload, account_index)
+
+    async def __refresh(self, payload):
+        state = None
+        while state is None:
+            state = self._states.decode(
+                payload, await self.__call("inspect", self._states.query(payload)))
+        return state
+
+    async def inspect(self, payload="xx"):
+        """
+        Return the game state or the projection a query returns, as Network.inspect does
+        """
+        task = self._inspecting.get(payload)
+        if task is None:
+            task = self._inspecting[payload] = asyncio.ensure_future(self.__refresh(payload))
+            task.add_done_callback(lambda _: self._inspecting.pop(payload, None))
+        # a waiter giving up must not cancel the call the others are waiting on
+        return await asyncio.shield(task)
+
+    async def wait_for(self, payload, predicate, timeout: float = None):
+        """
+        Return the game state as soon as predicate holds for it, or once timeout expires,
+        polling as Network.wait_for does without blocking the event loop
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        backoff = _Backoff(predicate, self._min_interval, self._max_interval)
+        state = await self.inspect(payload)
+        delay = backoff.delay(state)
+        while delay is not None:
+            if deadline is not None and loop.time() >= deadline:
+                return state
+            await asyncio.sleep(delay)
+            state = await self.inspect(payload)
+            delay = backoff.delay(state)
+
+        return state
+
+    def close(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,85 @@
+# Copyright 2022 Cartesi Pte. Ltd.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy of the
+# License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+"""
+Inspect query router
+
+Maps the path segments left once the game is selected to the projection answering them:
+
+    phase              started, daytime, round, move and vote counts, moderator, result
+    player/<address>   one player
+    alives             the players still alive
+    moves/<round>      the live moves of a night
+    since/<version>    the changes after a state version
+
+An empty path returns the whole game state, unknown paths are rejected.
+"""
+
+from werewolf import codec
+
+ROUTES = {}
+
+
+def route(name: str, arguments: int = 0):
+    """
+    Register a handler for the queries starting with name and followed by that many segments
+    """
+    def register(handler):
+        ROUTES[name] = (handler, arguments)
+        return handler
+    return register
+
+
+def _number(segment: str):
+    if not segment.isdigit():
+        raise ValueError(f"{segment} is not a number")
+    return int(segment)
+
+
+@route("phase")
+def phase(game):
+    return codec.encode_phase(game)
+
+
+@route("player", 1)
+def player(game, address: str):
+    return codec.encode_player_of(game, address.upper())
+
+
+@route("alives")
+def alives(game):
+    return codec.encode_alives(game)
+
+
+@route("moves", 1)
+def moves(game, round: str):
+    return codec.encode_moves_of(game, _number(round))
+
+
+@route("since", 1)
+def since(game, version: str):
+    return game.handle_inspect(_number(version))
+
+
+def resolve(game, query):
+    """
+    Answer the query path segments for the given game, raises ValueError on malformed queries
+    """
+    if query and query[0] in ROUTES:
+        handler, arguments = ROUTES[query[0]]
+        if len(query) - 1 != arguments:
+            raise ValueError(f"{query[0]} expects {arguments} argument(s)")
+        return handler(game, *query[1:])
+    if query:
+        raise ValueError(f"unknown query {'/'.join(query)}")
+
+    return game.handle_inspect()
@@ -0,0 +1,197 @@
+# Copyright 2022 Cartesi Pte. Ltd.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy of the
+# License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+import logging
+from werewolf.admission import admit, admit_join
+from werewolf.inputs import Input
+from werewolf.logs import Sampler
+from werewolf.metrics import METRICS
+from werewolf.model import Game, NUMBER_OF_PLAYER
+from werewolf.query import resolve
+
+logger = logging.getLogger(__name__)
+# payload the original client inspects the lobby with, a selector of its own
+LEGACY_SELECTOR = "xx"
+# rejected inputs are routine, only some of them make it to the log
+sample = Sampler()
+
+
+def _is_address(segment: str):
+    if len(segment) != 42 or segment[:2] not in ("0x", "0X"):
+        return False
+    try:
+        int(segment[2:], 16)
+    except ValueError:
+        return False
+    return True
+
+
+class Registry:
+    """
+    Werewolf game registry
+
+    Hosts many tables at once. Senders that are not seated yet join the open lobby, once the
+    lobby is full it becomes a running game and a new lobby is opened. Every later input of a
+    seated sender is routed to its game, failures of one game never leak into another.
+    Rejected inputs are counted by reason in the metrics, see werewolf.admission.
+
+    Inspect payloads are paths, the first segment selects the game either by id or by the
+    address of one of its players, the address of a sender not seated yet selects the open
+    lobby, as do LEGACY_SELECTOR and a path without a selector. Ids of games that do not
+    exist are rejected. The rest of the path is a query answered by werewolf.query, e.g.
+    `phase` or `since/<version>`.
+    """
+
+    def __init__(self, table_size: int = NUMBER_OF_PLAYER):
+        self._table_size = table_size
+        self._games = {}
+        self._seats = {}
+        self._seated = {}
+        self._next_id = 0
+        self._lobby = self.__open_lobby()
+
+    @property
+    def lobby(self):
+        return self._lobby
+
+    @property
+    def table_size(self):
+        return self._table_size
+
+    @property
+    def games(self):
+        return self._games
+
+    @property
+    def seated(self):
+        """
+        Number of players seated at a table
+        """
+        return len(self._seats)
+
+    def __open_lobby(self):
+        game_id = self._next_id
+        self._next_id += 1
+        self._games[game_id] = Game(game_id, self._table_size)
+        self._seated[game_id] = 0
+        return game_id
+
+    def __seat(self, game_id: int, sender: str):
+        self._seats[sender] = game_id
+        self._seated[game_id] += 1
+
+    def __release(self, game_id: int, sender: str):
+        del self._seats[sender]
+        self._seated[game_id] -= 1
+        if self._seated[game_id] == 0:
+            del self._seated[game_id]
+            del self._games[game_id]
+
+    def __is_leaving(self, game: Game, sender: str):
+        # the player reveals its key after the result was announced
+        if game._game_result != "":
+            return True
+        # a dead player reveals its key, nothing else is expected from it
+        return game._started and sender != game._moderator and sender not in game._alives
+
+    def snapshot(self):
+        return {
+            "table_size": self._table_size,
+            "next_id": self._next_id,
+            "lobby": self._lobby,
+            "games": [self._games[i].snapshot() for i in sorted(self._games)],
+            "seats": sorted([s, i] for s, i in self._seats.items()),
+        }
+
+    @classmethod
+    def restore(cls, state):
+        registry = cls.__new__(cls)
+        registry._table_size = state["table_size"]
+        registry._next_id = state["next_id"]
+        registry._lobby = state["lobby"]
+        registry._games = {}
+        registry._seated = {}
+        for g in state["games"]:
+            registry._games[g["id"]] = Game.restore(g)
+            registry._seated[g["id"]] = 0
+        registry._seats = {}
+        for sender, game_id in state["seats"]:
+            registry.__seat(game_id, sender)
+        return registry
+
+    def game_of(self, sender: str):
+        return self._seats.get(sender.upper())
+
+    def get(self, game_id: int):
+        return self._games.get(game_id)
+
+    def route_advance(self, sender: str):
+        """
+        Resolve the game an input of the given sender goes to
+        """
+        game_id = self._seats.get(sender.upper(), self._lobby)
+        return game_id, self._games[game_id]
+
+    def handle_advance(self, input: Input):
+        sender = input.sender
+        game_id, game = self.route_advance(sender)
+        leaving = self.__is_leaving(game, sender)
+
+        # inputs out of turn are turned down before reaching the game
+        reason = admit(game, input) if sender in self._seats else admit_join(game, input)
+        if reason is None:
+            try:
+                game.handle_advance(input)
+            except Exception as e:
+                if sample("rejected"):
+                    logger.warning("Game %d rejected input from %s: %s, %d so far", game_id,
+                                   sender, e, sample.seen("rejected"))
+                reason = "game"
+        if reason is not None:
+            # a rejected input never costs its sender the seat, a mistaken one is retried
+            METRICS.count(f"rejected.{reason}")
+            return "reject"
+
+        if game_id == self._lobby:
+            self.__seat(game_id, sender)
+            if game.is_full:
+                self._lobby = self.__open_lobby()
+        elif leaving or (sender == game._moderator and game._game_result != ""):
+            # the moderator has no key to reveal once it announced the result
+            self.__release(game_id, sender)
+
+        return "accept"
+
+    def route_inspect(self, payload: str):
+        """
+        Resolve an inspect path into the selected game and the remaining path segments,
+        raises ValueError when the selected game does not exist
+        """
+        segments = [s for s in payload.split("/") if s]
+        if segments:
+            head = segments[0]
+            if head.isdigit():
+                if int(head) not in self._games:
+                    raise ValueError(f"game {head} is not found")
+                return int(head), self._games[int(head)], segments[1:]
+
+            if head == LEGACY_SELECTOR:
+                return self._lobby, self._games[self._lobby], segments[1:]
+            if _is_address(head):
+                game_id = self._seats.get(head.upper(), self._lobby)
+                return game_id, self._games[game_id], segments[1:]
+
+        return self._lobby, self._games[self._lobby], segments
+
+    def handle_inspect(self, payload: str):
+        _, game, query = self.route_inspect(payload)
+        return resolve(game, query)
@@ -0,0 +1,124 @@
+# Copyright 2022 Cartesi Pte. Ltd.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy of the
+# License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+"""
+Offline replay of recorded inputs
+
+Rebuilds every game of an input log, written by the back-end when WEREWOLF_INPUT_LOG is set,
+and checks that each input gets the recorded status and notices. Games do not share any state
+so they are replayed in parallel:
+
+    python3 -m werewolf.replay inputs.jsonl --processes 8
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from werewolf.inputlog import read_records
+from werewolf.model import Game, NUMBER_OF_PLAYER
+
+
+def replay_game(records):
+    """
+    Replay the records of one game in order and report the inputs whose outcome differs
+    """
+    first = records[0]
+    game = Game(first.game, first.table_size or NUMBER_OF_PLAYER)
+    mismatches = []
+    start = time.perf_counter()
+    for record in records:
+        try:
+            game.handle_advance(record.input())
+            status = "accept"
+        except Exception:
+            status = "reject"
+        notices = game.pop_notices() if status == "accept" else []
+        game.pop_notices()
+
+        if status != record.status or notices != record.notices:
+            mismatches.append({"input_index": record.input_index, "status": status,
+                               "recorded_status": record.status, "notices": notices,
+                               "recorded_notices": record.notices})
+
+    return {"game": first.game, "inputs": len(records), "result": game._game_result,
+            "seconds": time.perf_counter() - start, "mismatches": mismatches}
+
+
+def _replay_chunk(games):
+    # warnings of rejected inputs are expected, they are compared with the recorded status
+    logging.disable(logging.CRITICAL)
+    return [replay_game(records) for records in games]
+
+
+def group_by_game(records):
+    games = {}
+    for record in records:
+        games.setdefault(record.game, []).append(record)
+    return list(games.values())
+
+
+def replay(path: str, processes: int = None):
+    """
+    Replay an input log and return a summary along with the result of every game
+    """
+    start = time.perf_counter()
+    games = group_by_game(read_records(path))
+    processes = processes or os.cpu_count() or 1
+
+    if processes == 1 or len(games) < 2:
+        results = _replay_chunk(games)
+    else:
+        # interleave the games so that every chunk gets long and short ones
+        chunks = [games[i::processes * 4] for i in range(min(len(games), processes * 4))]
+        results = []
+        with ProcessPoolExecutor(processes) as pool:
+            for chunk in pool.map(_replay_chunk, chunks):
+                results.extend(chunk)
+        results.sort(key=lambda r: r["game"])
+
+    elapsed = time.perf_counter() - start
+    inputs = sum(r["inputs"] for r in results)
+    outcomes = {}
+    for r in results:
+        outcomes[r["result"] or "unfinished"] = outcomes.get(r["result"] or "unfinished", 0) + 1
+    summary = {
+        "games": len(results),
+        "inputs": inputs,
+        "seconds": elapsed,
+        "inputs_per_second": inputs / elapsed if elapsed else 0.0,
+        "outcomes": outcomes,
+        "mismatched_games": sum(1 for r in results if r["mismatches"]),
+    }
+    return summary, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("path", help="input log, JSON lines or .bin")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--verbose", action="store_true", help="print the result of every game")
+    args = parser.parse_args()
+
+    summary, results = replay(args.path, args.processes)
+    for r in results:
+        if args.verbose or r["mismatches"]:
+            print(json.dumps(r))
+    print(json.dumps(summary, indent=2))
+    sys.exit(1 if summary["mismatched_games"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+# Copyright 2022 Cartesi Pte. Ltd.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy of the
+# License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+"""
+Batched role dispatch for the moderator and role verification at the end of a game
+
+Parses every key once and encrypts or decrypts the roles across a process pool for large
+tables. To compare the dispatch with encrypting one role at a time:
+
+    python3 -m werewolf.roles --players 6 60 600
+"""
+
+import argparse
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from werewolf.cipher import get_cipher
+
+# below this many players the pool costs more than it saves
+PARALLEL_THRESHOLD = 64
+
+
+def assign_roles(players, moderator: str, rnd=random):
+    """
+    Pick one werewolf among the players, everybody else but the moderator is a villager
+    """
+    others = [p for p in players if p != moderator]
+    werewolf = rnd.choice(others)
+    return {p: "WEREWOLF" if p == werewolf else "VILLAGER" for p in others}
+
+
+def _encrypt_chunk(chunk, cipher_name: str):
+    cipher = get_cipher(cipher_name)
+    keys = {}
+    encrypted = {}
+    for player, pub_key, role in chunk:
+        key = keys.get(pub_key)
+        if key is None:
+            key = keys[pub_key] = cipher.load_public(bytes.fromhex(pub_key))
+        encrypted[player] = cipher.encrypt(role.encode(), key).hex()
+    return encrypted
+
+
+def encrypt_roles(pub_keys, roles, processes: int = None, cipher_name: str = None):
+    """
+    Encrypt each player's role with its public key
+
+    pub_keys maps players to their DER public keys in hex, roles maps players to role names.
+    Returns the players' encrypted roles in hex, as Game.dispatch_roles expects them.
+    """
+    work = [(p, pub_keys[p], role) for p, role in roles.items()]
+    processes = processes or os.cpu_count() or 1
+    if processes == 1 or len(work) < PARALLEL_THRESHOLD:
+        return _encrypt_chunk(work, cipher_name)
+
+    # players sharing a key land in the same chunk so that it is parsed once
+    work.sort(key=lambda w: w[1])
+    size = -(-len(work) // processes)
+    chunks = [work[i:i + size] for i in range(0, len(work), size)]
+    encrypted = {}
+    with ProcessPoolExecutor(processes) as pool:
+        for result in pool.map(_encrypt_chunk, chunks, [cipher_name] * len(chunks)):
+            encrypted.update(result)
+    return {p: encrypted[p] for p in roles}
+
+
+def check_key(player: str, pub_key: str, private_key: str, cipher_name: str = None):
+    """
+    Load a revealed private key, raises ValueError unless it matches the player's public key
+
+    This only parses the keys, it is cheap next to decrypting the role.
+    """
+    cipher = get_cipher(cipher_name)
+    try:
+        key = cipher.load_private(bytes.fromhex(private_key))
+    except Exception:
+        raise ValueError(f"invalid private key revealed by {player}")
+    if cipher.dump_public(cipher.public_of(key)) != bytes.fromhex(pub_key):
+        raise ValueError(f"private key of {player} does not match its public key")
+    return key
+
+
+def _decrypt_chunk(chunk, cipher_name: str):
+    cipher = get_cipher(cipher_name)
+    keys = {}
+    roles = {}
+    for player, pub_key, private_key, encrypted_role in chunk:
+        key = keys.get(private_key)
+        if key is None:
+            key = keys[private_key] = check_key(player, pub_key, private_key, cipher_name)
+        try:
+            roles[player] = cipher.decrypt(bytes.fromhex(encrypted_role), key).decode()
+        except Exception:
+            raise ValueError(f"role of {player} cannot be decrypted")
+    return roles
+
+
+def decrypt_roles(revealed, processes: int = None, cipher_name: str = None):
+    """
+    Check the revealed private keys and decrypt the players' roles with them
+
+    revealed is a list of (player, public key, private key, encrypted role) tuples, all in hex.
+    Returns the players' role names, raises ValueError on the first key or role that does not
+    check out.
+    """
+    processes = processes or os.cpu_count() or 1
+    if processes == 1 or len(revealed) < PARALLEL_THRESHOLD:
+        return _decrypt_chunk(revealed, cipher_name)
+
+    work = sorted(revealed, key=lambda w: w[2])
+    size = -(-len(work) // processes)
+    chunks = [work[i:i + size] for i in range(0, len(work), size)]
+    roles = {}
+    with ProcessPoolExecutor(processes) as pool:
+        for result in pool.map(_decrypt_chunk, chunks, [cipher_name] * len(chunks)):
+            roles.update(result)
+    return {w[0]: roles[w[0]] for w in revealed}
+
+
+def dispatch_payload(encrypted_roles):
+    """
+    Hex payload of the moderator's role dispatch input
+    """
+    return json.dumps(encrypted_roles).encode().hex()
+
+
+def _encrypt_one_by_one(pub_keys, roles):
+    cipher = get_cipher()
+    return {p: cipher.encrypt(role.encode(), cipher.load_public(bytes.fromhex(pub_keys[p]))).hex()
+            for p, role in roles.items()}
+
+
+def _new_public_key(bits: int):
+    cipher = get_cipher()
+    return cipher.dump_public(cipher.new_keys(bits)[0]).hex()
+
+
+def benchmark(sizes, bits: int, distinct_keys: int = None, processes: int = None):
+    """
+    Time both dispatches for every table size, players get a key of their own unless
+    distinct_keys caps how many keys they share
+    """
+    count = min(distinct_keys or max(sizes), max(sizes))
+    with ProcessPoolExecutor(processes) as executor:
+        pool = list(executor.map(_new_public_key, [bits] * count))
+    results = []
+    for size in sizes:
+        players = [f"0X{i:040X}" for i in range(size)]
+        pub_keys = {p: pool[i % len(pool)] for i, p in enumerate(players)}
+        roles = assign_roles(players, players[0])
+
+        start = time.perf_counter()
+        _encrypt_one_by_one(pub_keys, roles)
+        serial = time.perf_counter() - start
+
+        start = time.perf_counter()
+        encrypt_roles(pub_keys, roles, processes)
+        batched = time.perf_counter() - start
+
+        results.append({"players": size, "one_by_one_s": serial, "batched_s": batched})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--players", type=int, nargs="+", default=[6, 60, 600])
+    parser.add_argument("--bits", type=int, default=2048)
+    parser.add_argument("--keys", type=int, default=None,
+                        help="distinct keys shared by the players, one per player by default")
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    for result in benchmark(args.players, args.bits, args.keys, args.processes):
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
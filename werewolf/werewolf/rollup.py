@@ -0,0 +1,120 @@
+# Copyright 2022 Cartesi Pte. Ltd.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy of the
+# License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+import logging
+import time
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class Latency:
+    """
+    Request counter and latency totals of one endpoint
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, elapsed: float, ok: bool):
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        if not ok:
+            self.errors += 1
+
+    def as_dict(self):
+        mean = self.total / self.count if self.count else 0.0
+        return {"count": self.count, "errors": self.errors, "mean": mean, "max": self.max}
+
+
+class RollupServer:
+    """
+    Rollup HTTP server transport
+
+    Keeps one pooled keep-alive session to the rollup server. Outputs produced while handling a
+    request are queued and sent back to back over that session before the next /finish, and an
+    idle server is polled with an exponential backoff between min_backoff and max_backoff seconds.
+    """
+
+    ENDPOINTS = ("finish", "notice", "report")
+
+    def __init__(self, url: str, min_backoff: float = 0.05, max_backoff: float = 2.0,
+                 pool_size: int = 4):
+        self._url = url.rstrip("/")
+        self._min_backoff = min_backoff
+        self._max_backoff = max_backoff
+        self._backoff = min_backoff
+        self._outputs = []
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self.latency = {e: Latency() for e in self.ENDPOINTS}
+
+    @property
+    def url(self):
+        return self._url
+
+    def close(self):
+        self._session.close()
+
+    def __post(self, endpoint: str, body):
+        start = time.perf_counter()
+        ok = False
+        try:
+            response = self._session.post(f"{self._url}/{endpoint}", json=body)
+            ok = response.status_code < 300
+            return response
+        finally:
+            self.latency[endpoint].add(time.perf_counter() - start, ok)
+
+    def notice(self, payload: str):
+        self._outputs.append(("notice", payload))
+
+    def report(self, payload: str):
+        self._outputs.append(("report", payload))
+
+    def flush(self):
+        """
+        Send every queued output, in order
+        """
+        outputs, self._outputs = self._outputs, []
+        for endpoint, payload in outputs:
+            response = self.__post(endpoint, {"payload": payload})
+            if response.status_code >= 300:
+                logger.warning("Rollup server refused %s with status %d body %s",
+                               endpoint, response.status_code, response.content)
+
+    def finish(self, status: str):
+        """
+        Flush pending outputs, then wait for the next rollup request and return it
+        """
+        self.flush()
+        while True:
+            response = self.__post("finish", {"status": status})
+            if response.status_code == 202:
+                logger.debug("No pending rollup request, trying again in %.2fs", self._backoff)
+                time.sleep(self._backoff)
+                self._backoff = min(self._backoff * 2, self._max_backoff)
+                continue
+
+            response.raise_for_status()
+            self._backoff = self._min_backoff
+            return response.json()
+
+    def stats(self):
+        return {e: l.as_dict() for e, l in self.latency.items() if l.count}
@@ -0,0 +1,232 @@
+# Copyright 2022 Cartesi Pte. Ltd.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy of the
+# License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+"""
+Multi-seat asyncio client
+
+Plays many seats, across as many tables as the back-end seats them at, from one event loop.
+Network calls run in a thread pool and RSA work in a process pool, so that waiting seats
+never hold the others back. Seats play the client's protocol and pick their moves with the
+bots' strategies:
+
+    python3 -m werewolf.seats --accounts 0-11 --werewolf always-kill
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+from concurrent.futures import ProcessPoolExecutor
+from werewolf.bots import STRATEGIES, Strategy
+from werewolf.cipher import get_cipher
+from werewolf.client import may_be_over
+from werewolf.keys import KeyPool
+from werewolf.network import AsyncNetwork
+from werewolf.roles import assign_roles, dispatch_payload, encrypt_roles
+
+logger = logging.getLogger(__name__)
+
+
+def _take_keys(cipher_name: str):
+    return KeyPool(cipher=get_cipher(cipher_name)).take()
+
+
+def _cipher_call(cipher_name: str, method: str, *args):
+    return getattr(get_cipher(cipher_name), method)(*args)
+
+
+class Crypto:
+    """
+    RSA work of the seats, run in a process pool so that it never blocks the event loop
+    """
+
+    def __init__(self, processes: int = None, cipher_name: str = None):
+        self._executor = ProcessPoolExecutor(processes)
+        self._cipher_name = cipher_name
+        self.cipher = get_cipher(cipher_name)
+
+    async def __run(self, f, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, f, *args)
+
+    async def take_keys(self):
+        return await self.__run(_take_keys, self._cipher_name)
+
+    async def encrypt(self, message: bytes, public_key):
+        return await self.__run(_cipher_call, self._cipher_name, "encrypt", message, public_key)
+
+    async def decrypt(self, ciphertext: bytes, private_key):
+        return await self.__run(_cipher_call, self._cipher_name, "decrypt", ciphertext, private_key)
+
+    async def encrypt_roles(self, pub_keys, roles):
+        return await self.__run(encrypt_roles, pub_keys, roles, 1, self._cipher_name)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+class Seat:
+    """
+    One player driven by strategies, the werewolf one is used once the seat gets that role
+    """
+
+    def __init__(self, net: AsyncNetwork, crypto: Crypto, account_index: int, address: str,
+                 werewolf: Strategy = None, villager: Strategy = None, rnd: random.Random = None):
+        self._net = net
+        self._crypto = crypto
+        self._account_index = account_index
+        self.address = address.upper()
+        self._strategies = {"WEREWOLF": werewolf or Strategy(), "VILLAGER": villager or Strategy()}
+        self._rnd = rnd or random.Random()
+        self.role = None
+        self.result = ""
+
+    async def __send(self, payload: str):
+        await self._net.send_on_chain(payload, self._account_index)
+
+    async def play(self):
+        """
+        Play one game through, return its result or an empty string when the seat left the
+        table before it was announced
+        """
+        cipher = self._crypto.cipher
+        address = self.address
+        public_key, private_key = await self._crypto.take_keys()
+        await self.__send(cipher.dump_public(public_key).hex())
+
+        g = await self._net.wait_for(address, lambda g: g.moderator)
+        moderator = g.moderator
+        seats = {p: i for i, p in enumerate(sorted(g.players))}
+
+        if address == moderator:
+            self.role = "MODERATOR"
+            roles = assign_roles(g.players, moderator, self._rnd)
+            werewolf = next(p for p, r in roles.items() if r == "WEREWOLF")
+            encrypted_roles = await self._crypto.encrypt_roles(
+                {p: g.players[p].pub_key for p in roles}, roles)
+            await self.__send(dispatch_payload(encrypted_roles))
+        else:
+            p = await self._net.wait_for(f"{address}/player/{address}",
+                                         lambda p: p.value.encrypted_role)
+            self.role = (await self._crypto.decrypt(
+                bytes.fromhex(p.value.encrypted_role), private_key)).decode()
+            strategy = self._strategies[self.role]
+        logger.info("%s plays %s", address, self.role)
+
+        g = await self._net.inspect(address)
+        moderator_public_key = cipher.load_public(bytes.fromhex(g.players[moderator].pub_key))
+        while not g.game_result:
+            is_daytime = g.is_daytime
+
+            if not is_daytime:
+                if self.role == "MODERATOR":
+                    phase = (await self._net.wait_for(
+                        f"{address}/phase", lambda p: p.value.moves >= p.value.alives)).value
+                    if phase.moves == phase.alives:
+                        victim = ""
+                        moves = (await self._net.inspect(f"{address}/moves/{phase.rounds}")).value
+                        for sender, move in moves:
+                            if sender == werewolf:
+                                victim = (await self._crypto.decrypt(
+                                    bytes.fromhex(move), private_key)).decode()
+                        await self.__send(victim.encode().hex())
+                elif not g.players[address].has_moved:
+                    move = "dummy"
+                    if self.role == "WEREWOLF":
+                        candidates = {p: 0 for p in g.alives if p != address}
+                        move = strategy.kill(address, candidates, seats, self._rnd)
+                    await self.__send((await self._crypto.encrypt(
+                        move.encode(), moderator_public_key)).hex())
+            elif self.role != "MODERATOR":
+                # vote again on every ballot until the day ends, ties lead to a revote
+                while g.is_daytime and not g.game_result:
+                    if not g.players[address].has_voted:
+                        candidates = {p: g.players[p].votes_got for p in g.alives
+                                      if p != address and g.players[p].can_be_voted}
+                        await self.__send(strategy.vote(address, candidates, seats, self._rnd)
+                                          .encode().hex())
+                    g = await self._net.wait_for(address, lambda g: not g.is_daytime or
+                                                 g.game_result or not g.players[address].has_voted)
+
+            # wait till day/night toggles
+            await self._net.wait_for(f"{address}/phase", lambda p: is_daytime !=
+                                     p.value.is_daytime or p.value.game_result)
+            g = await self._net.inspect(address)
+
+            if self.role == "MODERATOR":
+                alives = len(g.alives)
+                werewolf_alive = werewolf in g.alives
+                if alives > 2 and not werewolf_alive:
+                    # the game is settled once the werewolf's revealed key proves it died
+                    await self._net.wait_for(f"{address}/phase", lambda p: p.value.werewolf)
+                    await self.__send(b"finish".hex())
+                    break
+                elif alives == 2 and werewolf_alive:
+                    await self.__send(b"finish".hex())
+                    break
+            elif address not in g.alives:
+                break
+            else:
+                # wait for the moderator to check if the game finishes, as long as it may have
+                g = await self._net.wait_for(address, lambda g: g.game_result or
+                                             not may_be_over(g), timeout=15)
+
+        if self.role != "MODERATOR":
+            # reveal the private key, once dead or once the game is over
+            await self.__send(cipher.dump_private(private_key).hex())
+        # the seat leaves its table from then on, seats that left early never see the result
+        self.result = g.game_result
+        return self.result
+
+
+async def play_seats(seats):
+    """
+    Play every seat concurrently, return their results
+    """
+    return await asyncio.gather(*(seat.play() for seat in seats))
+
+
+def _indexes(spec: str):
+    first, _, last = spec.partition("-")
+    return list(range(int(first), int(last or first) + 1))
+
+
+async def _main(args):
+    net = AsyncNetwork(threads=args.threads)
+    crypto = Crypto(args.processes)
+    try:
+        accounts = await net.accounts()
+        rnd = random.Random(args.seed)
+        seats = [Seat(net, crypto, i, accounts[i], STRATEGIES[args.werewolf](),
+                      STRATEGIES[args.villagers](), random.Random(rnd.random()))
+                 for i in _indexes(args.accounts)]
+        for seat, result in zip(seats, await play_seats(seats)):
+            print(f"{seat.address} {seat.role}: {result or 'left before the result'}")
+    finally:
+        net.close()
+        crypto.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--accounts", default="0-5", help="account indexes, e.g. 0-11")
+    parser.add_argument("--werewolf", choices=sorted(STRATEGIES), default="random")
+    parser.add_argument("--villagers", choices=sorted(STRATEGIES), default="random")
+    parser.add_argument("--threads", type=int, default=32, help="concurrent network calls")
+    parser.add_argument("--processes", type=int, default=None, help="RSA worker processes")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
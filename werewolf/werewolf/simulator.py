@@ -0,0 +1,368 @@
+# Copyright 2022 Cartesi Pte. Ltd.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy of the
+# License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+"""
+Local rollup server simulator and load generator
+
+Serves /finish, /notice and /report to the real back-end loop and feeds it complete randomly
+played games, then reports the throughput and the latency of each handler:
+
+    python3 -m werewolf.simulator --games 20 --inspects 2
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import rsa
+from werewolf.codec import decode_report
+from werewolf.inputlog import Record
+from werewolf.inputs import Input
+from werewolf.model import NUMBER_OF_PLAYER
+from werewolf.registry import Registry
+
+
+def advance(sender: str, payload: str):
+    return {"request_type": "advance_state",
+            "data": {"metadata": {"msg_sender": sender}, "payload": "0x" + payload}}
+
+
+def inspect(query: str):
+    return {"request_type": "inspect_state",
+            "data": {"payload": "0x" + query.encode().hex()}}
+
+
+def percentile(samples, p: float):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+
+def game_script(rnd: random.Random, players, keys, inspects: int = 0):
+    """
+    Play one game the way the clients do, randomly voting and killing
+
+    Yields rollup requests or lists of requests that must not be interleaved with other
+    games, inspect requests are answered with the decoded state.
+    """
+    def poll():
+        # the mix of queries clients poll with
+        for _ in range(inspects):
+            p = rnd.choice(players)
+            yield inspect(rnd.choice([p, f"{p}/phase", f"{p}/player/{p}", f"{p}/alives"]))
+
+    # the players of a table have to join in a row
+    joins = []
+    for p in players:
+        joins.append(advance(p, keys[p][0].save_pkcs1("DER").hex()))
+        joins.extend(poll())
+    yield joins
+
+    g = yield inspect(players[0])
+    moderator = g.moderator
+    moderator_key = keys[moderator][0]
+    alives = [p for p in players if p != moderator]
+    werewolf = rnd.choice(alives)
+    roles = {p: rsa.encrypt(b"WEREWOLF" if p == werewolf else b"VILLAGER", keys[p][0]).hex()
+             for p in alives}
+    yield advance(moderator, json.dumps(roles).encode().hex())
+    yield from poll()
+
+    def reveal(p):
+        return advance(p, keys[p][1].save_pkcs1("DER").hex())
+
+    while True:
+        victim = rnd.choice([p for p in alives if p != werewolf])
+        for p in alives:
+            move = victim if p == werewolf else "dummy"
+            yield advance(p, rsa.encrypt(move.encode(), moderator_key).hex())
+            yield from poll()
+
+        g = yield inspect(moderator)
+        yield advance(moderator, victim.encode().hex())
+        alives.remove(victim)
+        yield reveal(victim)
+        yield from poll()
+        if len(alives) <= 2:
+            break
+
+        g = yield inspect(moderator)
+        while g.is_daytime:
+            candidates = [p for p in alives if g.players[p].can_be_voted]
+            for p in alives:
+                yield advance(p, rnd.choice(candidates).encode().hex())
+                yield from poll()
+            g = yield inspect(moderator)
+
+        voted_out = next(p for p in alives if p not in g.alives)
+        alives.remove(voted_out)
+        yield reveal(voted_out)
+        yield from poll()
+        if voted_out == werewolf or len(alives) <= 2:
+            break
+
+    yield advance(moderator, b"finish".hex())
+    for p in alives:
+        yield reveal(p)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # the back-end is terminated while it is still polling /finish
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class Simulator:
+    """
+    Stand-in for the rollup HTTP server
+
+    Interleaves the requests of every script round robin and measures how long the back-end
+    takes from receiving a request until it asks for the next one.
+    """
+
+    def __init__(self, scripts):
+        self._scripts = [[script, None, deque()] for script in scripts]
+        self._next = 0
+        self._pending = None
+        self._sent_at = 0.0
+        self._inputs = 0
+        self._lock = threading.Lock()
+        self.done = threading.Event()
+        self.latencies = {"advance_state": [], "inspect_state": []}
+        self.statuses = {}
+        self.notices = []
+        self.reports = []
+        self.started_at = None
+        self.finished_at = None
+
+    def __step(self, script, answer):
+        try:
+            return script.send(answer)
+        except StopIteration:
+            return None
+
+    def __next_request(self):
+        # a script keeps the turn until the batch it yielded is drained
+        if self._pending is not None and self._scripts[self._pending][2]:
+            return self._scripts[self._pending][2].popleft()
+
+        while self._scripts:
+            self._next %= len(self._scripts)
+            entry = self._scripts[self._next]
+            request = self.__step(entry[0], entry[1])
+            if request is None:
+                del self._scripts[self._next]
+                continue
+
+            entry[1] = None
+            if isinstance(request, list):
+                entry[2].extend(request[1:])
+                request = request[0]
+            self._pending = self._next
+            self._next += 1
+            return request
+
+        return None
+
+    def __answer(self, status: str):
+        # inspect requests of a script are answered with the last report, rejected ones
+        # report an error message rather than a state and are answered with None
+        if status == "accept" and self.reports:
+            report = bytes.fromhex(self.reports[-1][2:]).decode()
+            self._scripts[self._pending][1] = decode_report(report)
+
+    def finish(self, status: str):
+        with self._lock:
+            now = time.perf_counter()
+            if self.started_at is None:
+                self.started_at = now
+
+            if self._pending is not None:
+                request_type = self._request_type
+                self.latencies[request_type].append(now - self._sent_at)
+                key = (request_type, status)
+                self.statuses[key] = self.statuses.get(key, 0) + 1
+                if request_type == "inspect_state":
+                    self.__answer(status)
+
+            request = self.__next_request()
+            if request is None:
+                self.finished_at = now
+                self.done.set()
+                return None
+
+            self._request_type = request["request_type"]
+            if self._request_type == "advance_state":
+                request["data"]["metadata"]["input_index"] = self._inputs
+                self._inputs += 1
+            self._sent_at = time.perf_counter()
+            return request
+
+    def serve(self, host: str = "127.0.0.1", port: int = 0):
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def __reply(self, code: int, body: bytes = b""):
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if self.path == "/finish":
+                    request = simulator.finish(body["status"])
+                    if request is None:
+                        self.__reply(202)
+                    else:
+                        self.__reply(200, json.dumps(request).encode())
+                elif self.path == "/notice":
+                    simulator.notices.append(body["payload"])
+                    self.__reply(201, json.dumps({"index": len(simulator.notices) - 1}).encode())
+                elif self.path == "/report":
+                    simulator.reports.append(body["payload"])
+                    self.__reply(202)
+                else:
+                    self.__reply(404)
+
+        server = _Server((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def summary(self):
+        elapsed = (self.finished_at or time.perf_counter()) - (self.started_at or 0.0)
+        inputs = sum(len(l) for l in self.latencies.values())
+        result = {
+            "inputs": inputs,
+            "seconds": elapsed,
+            "inputs_per_second": inputs / elapsed if elapsed else 0.0,
+            "notices": len(self.notices),
+            "reports": len(self.reports),
+            "statuses": {f"{t}/{s}": n for (t, s), n in sorted(self.statuses.items())},
+        }
+        for request_type, samples in self.latencies.items():
+            result[request_type] = {
+                "count": len(samples),
+                "p50_ms": percentile(samples, 0.5) * 1000,
+                "p99_ms": percentile(samples, 0.99) * 1000,
+            }
+        return result
+
+
+def make_scripts(games: int, inspects: int = 0, seed: int = 0, bits: int = 512,
+                 table_size: int = NUMBER_OF_PLAYER, distinct_keys: int = 12):
+    """
+    Build one game script per table, keys are drawn from a small pool to keep setup cheap
+    """
+    rnd = random.Random(seed)
+    pool = [rsa.newkeys(bits) for _ in range(distinct_keys)]
+    scripts = []
+    for g in range(games):
+        players = [f"0X{g * table_size + i + 1:040X}" for i in range(table_size)]
+        keys = {p: rnd.choice(pool) for p in players}
+        scripts.append(game_script(random.Random(rnd.random()), players, keys, inspects))
+    return scripts
+
+
+def play_in_process(scripts, registry: Registry):
+    """
+    Play the scripts one after the other straight through a registry, without a back-end
+    process, and return the advance inputs as input log records
+    """
+    records = []
+    for script in scripts:
+        answer = None
+        while True:
+            try:
+                requests = script.send(answer)
+            except StopIteration:
+                break
+            answer = None
+            for request in requests if isinstance(requests, list) else [requests]:
+                data = request["data"]
+                if request["request_type"] == "inspect_state":
+                    answer = decode_report(registry.handle_inspect(
+                        bytes.fromhex(data["payload"][2:]).decode()))
+                    continue
+
+                sender = data["metadata"]["msg_sender"]
+                payload = data["payload"][2:]
+                game_id, game = registry.route_advance(sender)
+                status = registry.handle_advance(Input.decode(sender, bytes.fromhex(payload)))
+                notices = game.pop_notices()
+                records.append(Record(len(records), game_id, sender, bytes.fromhex(payload),
+                                      status, notices if status == "accept" else [],
+                                      registry.table_size))
+    return records
+
+
+def run(games: int, inspects: int = 0, seed: int = 0, bits: int = 512,
+        table_size: int = NUMBER_OF_PLAYER, verbose: bool = False, timeout: float = 600):
+    """
+    Play the given number of games through a back-end process and return the summary
+    """
+    simulator = Simulator(make_scripts(games, inspects, seed, bits, table_size))
+    server = simulator.serve()
+    env = dict(os.environ,
+               ROLLUP_HTTP_SERVER_URL=f"http://127.0.0.1:{server.server_port}",
+               WEREWOLF_TABLE_SIZE=str(table_size))
+    output = None if verbose else subprocess.DEVNULL
+    dapp = subprocess.Popen([sys.executable, "-m", "werewolf.dapp"], env=env,
+                            stdout=output, stderr=output)
+    deadline = time.monotonic() + timeout
+    try:
+        while not simulator.done.wait(0.1):
+            if dapp.poll() is not None:
+                raise RuntimeError(f"back-end exited with status {dapp.returncode}")
+            if time.monotonic() > deadline:
+                raise TimeoutError("back-end did not process every input in time")
+    finally:
+        dapp.terminate()
+        dapp.wait()
+        server.shutdown()
+
+    return simulator.summary()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--games", type=int, default=10, help="number of games to play")
+    parser.add_argument("--inspects", type=int, default=1, help="inspect requests after each advance")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--bits", type=int, default=512, help="RSA key size of the players")
+    parser.add_argument("--players", type=int, default=NUMBER_OF_PLAYER, help="players per table")
+    parser.add_argument("--verbose", action="store_true", help="show the back-end logs")
+    args = parser.parse_args()
+
+    summary = run(args.games, args.inspects, args.seed, args.bits, args.players, args.verbose)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()